@@ -0,0 +1,184 @@
+# Python 3.6.5 script for analysing images sent over HTTP by a local program
+# Specifically keeps a pool of worker processes with OpenCV and the analysis
+# loaded and ready, so a frame sent by the acquisition software is measured
+# without starting a new Python process for every batch.
+
+# Imports:
+import base64
+import http.server
+import json
+import multiprocessing
+import socketserver
+import time
+import urllib.parse
+import cv2
+import numpy as np
+import determineParticleSizes
+from particleTable import COLUMNS
+
+
+# Global constants - FEEL FREE TO MODIFY
+# Address to listen on. Keep HOST at 127.0.0.1 so only programs on this computer
+# can send images.
+HOST = "127.0.0.1"
+PORT = 8765
+
+# Number of worker processes analysing frames at the same time, 0 for every core
+NUM_WORKERS = 0
+
+# Seconds a request waits for its frames to be analysed before it is answered
+# with an error, so a frame that never finishes cannot hold up the client forever
+REQUEST_TIMEOUT = 60
+
+# Settings of determineParticleSizes.py every frame is analysed with unless a
+# request gives its own, e.g. {"THRESH_PARAM": 60, "AVG_PARTICLE_HEIGHT": 5.0}
+DEFAULT_SETTINGS = {}
+
+# The worker pool, started by main(), and its number of workers
+pool = None
+num_workers = 0
+
+
+def main():
+    global pool, num_workers
+    num_workers = NUM_WORKERS if NUM_WORKERS > 0 else multiprocessing.cpu_count()
+    pool = multiprocessing.Pool(num_workers, determineParticleSizes.init_worker,
+                                ({"TEST": False, "DEBUG_STAGES": []},))
+
+    server = AnalysisServer((HOST, PORT), AnalysisHandler)
+    print("Analysing frames at http://" + HOST + ":" + str(server.server_address[1]) +
+          " with " + str(num_workers) + " workers. Press Ctrl+C to stop.")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        pool.close()
+        pool.join()
+
+
+# HTTP server answering every request on its own thread, so requests wait on
+# the worker pool rather than on each other
+class AnalysisServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+# Answers the requests of the server:
+#   GET  /health   - {"status": "ok", "workers": number of workers}
+#   POST /analyse  - analyses one frame sent as the body. The body is an image
+#                    file (.bmp, .png, .tif, ...), or the raw 8-bit grayscale
+#                    pixels of the frame if the width and height parameters are
+#                    given. Parameters: name (of the frame), width, height and
+#                    any settings of determineParticleSizes.py, e.g. THRESH_PARAM=60
+#   POST /batch    - analyses several frames sent as JSON: {"frames": [{"name":
+#                    ..., "image": base64 encoded image file}, ...], "settings":
+#                    {...}}. Frames are spread over the workers.
+# Results are sent back as JSON, see frame_result(). Bad requests, including
+# frames no wider than CROP_BORDER_WIDTH, get a 400 error and requests that take
+# longer than REQUEST_TIMEOUT a 504.
+class AnalysisHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if urllib.parse.urlparse(self.path).path == "/health":
+            self.send_json(200, {"status": "ok", "workers": num_workers})
+        else:
+            self.send_json(404, {"error": "Unknown path: " + self.path})
+
+    def do_POST(self):
+        url = urllib.parse.urlparse(self.path)
+        params = dict(urllib.parse.parse_qsl(url.query))
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        try:
+            if url.path == "/analyse":
+                name = params.pop("name", "frame")
+                width = params.pop("width", None)
+                height = params.pop("height", None)
+                settings = {key: parse_setting(value) for key, value in params.items()}
+                if width is not None and height is not None:
+                    shape = (int(height), int(width))
+                    determineParticleSizes.check_image_size(shape[0], shape[1], name)
+                    result = pool.apply_async(analyse_raw_frame, (body, shape, request_config(settings), name))
+                else:
+                    result = pool.apply_async(analyse_encoded_frame, (body, request_config(settings), name))
+                self.send_json(200, result.get(REQUEST_TIMEOUT))
+            elif url.path == "/batch":
+                request = json.loads(body.decode())
+                config = request_config(request.get("settings", {}))
+                frames = [(base64.b64decode(frame["image"]), config, frame.get("name", "frame_" + str(i)))
+                          for i, frame in enumerate(request["frames"])]
+                result = pool.starmap_async(analyse_encoded_frame, frames)
+                self.send_json(200, {"frames": result.get(REQUEST_TIMEOUT)})
+            else:
+                self.send_json(404, {"error": "Unknown path: " + self.path})
+        except (ValueError, KeyError, TypeError) as error:
+            self.send_json(400, {"error": str(error)})
+        except multiprocessing.TimeoutError:
+            self.send_json(504, {"error": "The frames were not analysed within " + str(REQUEST_TIMEOUT) + " seconds"})
+        except Exception as error:
+            self.send_json(500, {"error": repr(error)})
+
+    def send_json(self, status, content):
+        body = json.dumps(content).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+# Turn a setting given as a URL parameter into a number, True/False or a list
+# if it is written as one in JSON, and leave it as a string otherwise
+def parse_setting(value):
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+# The AnalysisConfig of a request, from DEFAULT_SETTINGS and the settings it gives
+def request_config(settings):
+    request_settings = dict(DEFAULT_SETTINGS)
+    request_settings.update(settings)
+
+    return determineParticleSizes.AnalysisConfig(**request_settings)
+
+
+# Analyse a frame sent as an image file, in a worker process. Frames too small
+# to analyse are only found once they are decoded, and are turned down by
+# analyse_image() with a ValueError.
+def analyse_encoded_frame(encoded, config, name):
+    img = cv2.imdecode(np.frombuffer(encoded, dtype = np.uint8), cv2.IMREAD_ANYCOLOR)
+    if img is None:
+        raise ValueError("Could not decode the image of " + name)
+
+    return analyse_frame(img, config, name)
+
+
+# Analyse a frame sent as raw 8-bit grayscale pixels, in a worker process
+def analyse_raw_frame(pixels, shape, config, name):
+    if len(pixels) != shape[0] * shape[1]:
+        raise ValueError("Expected " + str(shape[0] * shape[1]) + " bytes of pixels for " + name +
+                         ", got " + str(len(pixels)))
+
+    return analyse_frame(np.frombuffer(pixels, dtype = np.uint8).reshape(shape), config, name)
+
+
+# Analyse a frame and return its result, see frame_result()
+def analyse_frame(img, config, name):
+    start = time.perf_counter()
+    table = determineParticleSizes.analyse_image(img, config, name)
+
+    return frame_result(table, time.perf_counter() - start)
+
+
+# The JSON result of a frame: its name, the number of particles measured, the
+# seconds the analysis took, and the rows of the particles in the same columns
+# as the data sheet
+def frame_result(table, seconds):
+    return {"name": table.file_name, "particles": len(table), "seconds": seconds,
+            "columns": COLUMNS, "rows": table.rows()}
+
+
+# Run the main program
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+# Python 3.6.5 script for benchmarking determineParticleSizes.py
+# Specifically generates synthetic particle images, in the style of the uniform
+# particles of TestSets Set1-Set3, and times every stage of the analysis on them.
+
+# Imports:
+import contextlib
+import io
+import itertools
+import json
+import math
+import os
+import pathlib
+import tempfile
+import time
+import cv2
+import numpy as np
+import determineParticleSizes
+import runMetrics
+from resultStore import ExcelSink
+
+
+# Global constants - FEEL FREE TO MODIFY
+# Every combination of image size (width, height) and particle count is benchmarked
+RESOLUTIONS = [(1024, 1024), (2048, 2048)]
+PARTICLE_COUNTS = [50, 500]
+
+# Particle diameters in pixels. SIZE_DISTRIBUTION is "fixed" (every particle is
+# SIZE_MEDIAN across, like the test sets), "uniform" (between SIZE_MIN and SIZE_MAX)
+# or "lognormal" (around SIZE_MEDIAN, with SIZE_SPREAD the sigma of its log).
+# Particles are ellipses whose minor axis is between MIN_ASPECT_RATIO and 1
+# times their diameter, turned to a random angle.
+SIZE_DISTRIBUTION = "lognormal"
+SIZE_MEDIAN = 20
+SIZE_SPREAD = 0.5
+SIZE_MIN = 4
+SIZE_MAX = 120
+MIN_ASPECT_RATIO = 0.5
+
+# Grey levels of the background and particles, the sigma of the Gaussian blur
+# applied to the particles (0 for sharp edges) and the sigma of the Gaussian
+# noise added to the whole image (0 for none)
+BACKGROUND_LEVEL = 255
+PARTICLE_LEVEL = 0
+BLUR_SIGMA = 1.0
+NOISE_SIGMA = 4.0
+
+# Number of times each image is analysed. The stage times of every repeat are kept.
+REPEATS = 3
+SEED = 0
+
+# Machine-readable results are written here as JSON
+BENCHMARK_RESULTS = str(pathlib.Path("benchmark_results.json"))
+
+# Stages of determineParticleSizes.analyse() in the order they run, as they are
+# named in its runMetrics record, followed by the write of the results. Tiles of a
+# TILED analysis add their times to the same stages.
+STAGES = ["crop", "grayscale", "clahe", "threshold", "denoise", "sobel", "laplacian",
+          "contours", "measurement", "overlay", "excel_write"]
+
+
+def main():
+    results = run_benchmark()
+    print_results(results)
+
+    with open(BENCHMARK_RESULTS, "w") as file:
+        json.dump(results, file, indent = 2)
+    print("Benchmark results written to " + BENCHMARK_RESULTS)
+
+
+# Benchmark every combination of RESOLUTIONS and PARTICLE_COUNTS. Returns a
+# dictionary with the settings used and the timings of every case.
+def run_benchmark():
+    rng = np.random.RandomState(SEED)
+    cases = []
+    for (width, height), num_particles in itertools.product(RESOLUTIONS, PARTICLE_COUNTS):
+        img = make_frame(width, height, num_particles, rng)
+        cases.append(benchmark_frame(img, width, height, num_particles))
+
+    return {"settings": benchmark_settings(), "cases": cases}
+
+
+# The generator and analysis settings the benchmark ran with
+def benchmark_settings():
+    settings = {name: globals()[name] for name in
+                ["SIZE_DISTRIBUTION", "SIZE_MEDIAN", "SIZE_SPREAD", "SIZE_MIN", "SIZE_MAX",
+                 "MIN_ASPECT_RATIO", "BACKGROUND_LEVEL", "PARTICLE_LEVEL", "BLUR_SIGMA",
+                 "NOISE_SIGMA", "REPEATS", "SEED"]}
+    for name in determineParticleSizes.WORKER_SETTINGS:
+        settings[name] = getattr(determineParticleSizes, name)
+    settings["opencv_version"] = cv2.__version__
+    settings["numpy_version"] = np.__version__
+    settings["cpu_count"] = os.cpu_count()
+
+    return settings
+
+
+# Make a synthetic BGR image of num_particles particles on a plain background.
+# Particles are kept clear of the edges and of the left border that gets
+# cropped off, but may overlap each other.
+def make_frame(width, height, num_particles, rng):
+    img = np.full((height, width), BACKGROUND_LEVEL, dtype = np.uint8)
+    diameters = particle_diameters(num_particles, rng)
+    margin = int(math.ceil(diameters.max() / 2)) + 3 if num_particles > 0 else 0
+    left = margin + 11
+
+    xs = rng.randint(left, max(width - margin, left + 1), num_particles)
+    ys = rng.randint(margin, max(height - margin, margin + 1), num_particles)
+    ratios = rng.uniform(MIN_ASPECT_RATIO, 1, num_particles)
+    angles = rng.uniform(0, 180, num_particles)
+    for x, y, diameter, ratio, angle in zip(xs, ys, diameters, ratios, angles):
+        axes = (max(int(round(diameter / 2)), 1), max(int(round(diameter * ratio / 2)), 1))
+        cv2.ellipse(img, (int(x), int(y)), axes, float(angle), 0, 360, PARTICLE_LEVEL, -1)
+
+    if BLUR_SIGMA > 0:
+        img = cv2.GaussianBlur(img, (0, 0), BLUR_SIGMA)
+    if NOISE_SIGMA > 0:
+        noise = rng.normal(0, NOISE_SIGMA, img.shape)
+        img = np.clip(img + noise, 0, 255).astype(np.uint8)
+
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR)
+
+
+# Draw num_particles particle diameters from SIZE_DISTRIBUTION
+def particle_diameters(num_particles, rng):
+    if SIZE_DISTRIBUTION == "fixed":
+        diameters = np.full(num_particles, float(SIZE_MEDIAN))
+    elif SIZE_DISTRIBUTION == "uniform":
+        diameters = rng.uniform(SIZE_MIN, SIZE_MAX, num_particles)
+    elif SIZE_DISTRIBUTION == "lognormal":
+        diameters = SIZE_MEDIAN * np.exp(rng.normal(0, SIZE_SPREAD, num_particles))
+    else:
+        raise ValueError("Unknown SIZE_DISTRIBUTION: " + str(SIZE_DISTRIBUTION))
+
+    return np.clip(diameters, SIZE_MIN, SIZE_MAX)
+
+
+# Analyse one image REPEATS times, timing each stage of analyse(). Returns the
+# timings of the case along with how many particles were measured.
+def benchmark_frame(img, width, height, num_particles):
+    timings = {stage: [] for stage in STAGES}
+    totals = []
+    num_found = 0
+    for repeat in range(REPEATS):
+        times, total, num_found = time_stages(img)
+        for stage in STAGES:
+            timings[stage].append(times.get(stage, 0.0))
+        totals.append(total)
+
+    stages = {stage: summarise_times(timings[stage]) for stage in STAGES}
+    stages["total"] = summarise_times(totals)
+
+    return {"width": width, "height": height, "particles": num_particles,
+            "particles_measured": num_found, "stages": stages}
+
+
+# Analyse img with analyse() and write its results to an Excel file, reading the
+# time of every stage back from the runMetrics record of the image. Debug images
+# are switched off so only the analysis itself is timed. Returns the seconds
+# taken by each stage, the seconds taken altogether and the number of particles
+# measured.
+def time_stages(img):
+    start = time.perf_counter()
+    runMetrics.begin_image("benchmark")
+    try:
+        with contextlib.redirect_stdout(io.StringIO()), tempfile.TemporaryDirectory() as folder:
+            table = determineParticleSizes.analyse_image(img, None, "benchmark")
+
+            with runMetrics.stage("excel_write"):
+                sink = ExcelSink(os.path.join(folder, "benchmark.xlsx"))
+                sink.write(table)
+                sink.close()
+    finally:
+        record = runMetrics.end_image()
+
+    return record["stages"], time.perf_counter() - start, len(table)
+
+
+# The mean, median, minimum and maximum of a list of times in seconds
+def summarise_times(times):
+    return {"mean": float(np.mean(times)), "median": float(np.median(times)),
+            "min": float(np.min(times)), "max": float(np.max(times))}
+
+
+# Print the median time of every stage of each case in milliseconds
+def print_results(results):
+    for case in results["cases"]:
+        print(str(case["width"]) + "x" + str(case["height"]) + ", " + str(case["particles"]) +
+              " particles (" + str(case["particles_measured"]) + " measured):")
+        for stage in STAGES + ["total"]:
+            print("    " + stage.ljust(12) + str(round(case["stages"][stage]["median"] * 1000, 2)).rjust(10) + " ms")
+
+
+# Run the main program
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+# Python 3.6.5 script for storing the cropped threshold images of the particles
+# Specifically packs every crop of a run into a single append-only file with an
+# index next to it, so any particle's crop can be read back without loading the rest.
+
+# Imports:
+import csv
+import pathlib
+import numpy as np
+
+
+# Header of the index file. Each crop is stored as its rows of bits packed into
+# bytes, starting at offset in the data file.
+INDEX_COLUMNS = ["File_Name", "Particle_ID", "Offset", "Height", "Width"]
+
+
+# The data and index file names of the archive at path, e.g. crops.bin and crops.idx
+def archive_files(path):
+    path = pathlib.Path(str(path))
+    return path.with_suffix(".bin"), path.with_suffix(".idx")
+
+
+# Writes crops to an archive, replacing any archive already at path. Crops are
+# binary masks, so only whether each pixel is set is kept, 8 pixels to a byte.
+# Everything is flushed after each image, so the archive can be read while a
+# run is still going.
+class CropArchiveWriter:
+    def __init__(self, path):
+        data_filename, index_filename = archive_files(path)
+        self.data_file = open(str(data_filename), "wb")
+        self.index_file = open(str(index_filename), "w", newline = "")
+        self.index = csv.writer(self.index_file)
+        self.index.writerow(INDEX_COLUMNS)
+        self.offset = 0
+        self.num_crops = 0
+
+    # Append the crops of one image, where crops[i] belongs to particle i, the
+    # i-th row of that image in the results
+    def write(self, file_name, crops):
+        for particle_id in range(len(crops)):
+            crop = crops[particle_id]
+            packed = np.packbits(crop > 0)
+            self.data_file.write(packed.tobytes())
+            self.index.writerow([file_name, particle_id, self.offset, crop.shape[0], crop.shape[1]])
+            self.offset = self.offset + len(packed)
+        self.num_crops = self.num_crops + len(crops)
+
+        self.data_file.flush()
+        self.index_file.flush()
+
+    def close(self):
+        self.data_file.close()
+        self.index_file.close()
+
+
+# Reads crops back out of an archive. The data file is memory-mapped, so only
+# the crops asked for are ever read from disk.
+class CropArchive:
+    def __init__(self, path):
+        data_filename, index_filename = archive_files(path)
+        self.index = {}
+        with open(str(index_filename), newline = "") as file:
+            reader = csv.reader(file)
+            next(reader)
+            for file_name, particle_id, offset, height, width in reader:
+                self.index[(file_name, int(particle_id))] = (int(offset), int(height), int(width))
+
+        if self.index:
+            self.data = np.memmap(str(data_filename), dtype = np.uint8, mode = "r")
+        else:
+            self.data = np.zeros(0, dtype = np.uint8)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, key):
+        return key in self.index
+
+    # The (file_name, particle_id) keys of every crop, in the order they were written
+    def keys(self):
+        return self.index.keys()
+
+    # The crop of a particle as a 0/255 image, like the threshold image it came from
+    def crop(self, file_name, particle_id):
+        offset, height, width = self.index[(file_name, particle_id)]
+        num_bytes = (height * width + 7) // 8
+        bits = np.unpackbits(self.data[offset : offset + num_bytes], count = height * width)
+
+        return bits.reshape(height, width) * np.uint8(255)
@@ -6,11 +6,25 @@
 # Imports:
 import cv2
 import numpy as np
-import xlsxwriter as xls
 import math
-from itertools import compress
 import pathlib
 import os, os.path
+import multiprocessing
+import multiprocessing.util
+import time
+import threading
+import concurrent.futures
+import collections
+from particleTable import ParticleTable, FOCUS_COLUMNS
+from resultStore import open_result_sink, export_excel
+from imageWriter import ImageWriter
+from cropArchive import CropArchiveWriter
+from resultCache import ResultCache
+from particleTracker import ParticleTracker
+import overlayRenderer
+import repeatParticleRemoval
+import runMetrics
+import frameSource
 
 # Global declarations:
 ############################## DO NOT MODIFY ###################################
@@ -18,24 +32,21 @@ PROJECTED_PIXEL_SIZE = 3.45
 CLARITY_THRESHOLD = 10
 AREA_THRESHOLD_MIN = 3
 AREA_THRESHOLD_MAX = 18000
+CROP_BORDER_WIDTH = 11
 
-# A list of cropped images to be written out when TEST is True
-crops = []
-
-# Global Lists of Measurements:
-filtered_min_area_rects = []
-auto_areas = []
-pixel_areas = []
-auto_diameters = []
-pixel_diameters = []
-major_axes = []
-minor_axes = []
-aspect_ratios = []
-eccentricities = []
-surface_areas = []
-sauter_diameters = []
-volumes = []
-sphericities = []
+# Particles of fewer pixels than this cannot surround another particle, so they
+# can be left out of the contour search without changing any other contour. 4
+# is the smallest ring of pixels that can enclose anything. It is not a setting:
+# larger values can drop particles that do surround others and change results.
+MIN_ENCLOSING_AREA = 4
+
+# Write the debug images out in the background, one writer for every set of
+# DEBUG_ settings in use, each started on first use
+image_writers = {}
+image_writer_lock = threading.Lock()
+
+# The cache of particles found in earlier runs, opened on first use
+result_cache = None
 
 
 # Modified with user prompt - PLEASE DO NOT CHANGE THIS HERE
@@ -46,136 +57,725 @@ IMAGE_FOLDER_PATH = str(pathlib.Path("../Test Images/First Sample Images"))
 TEST_RESULTS_PATH = str(pathlib.Path(IMAGE_FOLDER_PATH + "/img_results"))
 RESULTS_FILENAME = str(pathlib.Path(TEST_RESULTS_PATH + "/results_test.xlsx"))
 
+# The results are written in the format matching the extension of RESULTS_FILENAME:
+# .xlsx for an Excel workbook, .csv for a CSV file or .sqlite for an SQLite database.
+# CSV and SQLite are much faster for large runs. Turn True to also generate an
+# Excel workbook next to them once the analysis is done.
+EXPORT_EXCEL = False
+
+# The summary sheet always holds the summary values calculated during the analysis.
+# Turn False to leave out the Excel functions that recalculate them from the data sheet.
+SUMMARY_FORMULAS = True
+
 
 # Turn True if you would like to customize the threshold parameter!
 # False results in the default Otsu Algorithm optimum threshold calculation.
 CUSTOM_THRESH = True
 THRESH_PARAM = 80
 
+# Focus measure CLARITY_THRESHOLD is applied to. Every particle gets all of them
+# in the data sheet: "Sobel_Max" (the strongest edge, the original measure),
+# "Mean_Gradient" (the average edge strength) or "Laplacian_Var" (the variance
+# of the Laplacian). Each is measured over the particle and FOCUS_RING pixels
+# around it, so the edges of neighbouring particles are left out. The measures
+# have different scales, so CLARITY_THRESHOLD has to be picked for the one used.
+CLARITY_MEASURE = "Sobel_Max"
+FOCUS_RING = 2
+
+# Size in pixels of the regions CLAHE evens out the contrast of. 0 splits every
+# image into an 8x8 grid of regions, so their size depends on the image size.
+# Tiled analysis needs a fixed size and uses 250 pixels when this is 0.
+CLAHE_CELL_SIZE = 0
+
+# Tiled analysis toggle. If True, images larger than TILE_SIZE pixels are analysed
+# in tiles of TILE_SIZE x TILE_SIZE pixels, so memory use depends on the tile size
+# instead of the image size, which matters for stitched mosaics. Each tile is
+# analysed along with a TILE_HALO pixel border of its neighbours, and a particle
+# belongs to the tile its bounding rectangle starts in, so particles crossing a
+# seam are measured once and in full. Particles must be shorter than about
+# TILE_HALO minus half a CLAHE region to be measured the same as without tiles.
+# Both sizes are rounded up to whole CLAHE regions. TILE_THREADS tiles are
+# analysed at the same time (0 uses every core).
+TILED = False
+TILE_SIZE = 2000
+TILE_HALO = 500
+TILE_THREADS = 1
+
+# Denoising applied before the Sobel filter that decides whether particles are
+# in focus. One of "nlmeans" (slowest, the original filter), "bilateral", "median"
+# or "none". The threshold, and so the particle areas, never use the denoised image.
+DENOISE_METHOD = "nlmeans"
+
+# Turn True to only denoise around the particles that could be measured instead
+# of the whole image, which is much faster on images with few particles. Each
+# particle's bounding rectangle is grown by DENOISE_ROI_PADDING pixels on every side.
+DENOISE_ROI_ONLY = False
+DENOISE_ROI_PADDING = 16
+
 # Testing toggle. If True, writes out each step to image files.
 TEST = True
 
+# Metrics toggle. If True, times every stage of the analysis of each image and
+# keeps counts such as the number of contours found. They are written next to
+# RESULTS_FILENAME as results_metrics.json (or .csv, per METRICS_FORMAT), and a
+# short summary is printed at the end of the run.
+COLLECT_METRICS = False
+METRICS_FORMAT = ".json"
+
+# Debug images to write out, named after the step that made them. Remove any you
+# do not need. Steps 1-4 and the crops are only written when TEST is True, while
+# the rectangle images (5 and 6) are always written unless removed here. The
+# crops of every particle are packed into crops.bin and crops.idx, which can be
+# read back with cropArchive.CropArchive.
+DEBUG_STAGES = ["1_original", "2_gray", "3_denoised", "4_clahe_denoise",
+                "5_rect_thresh_image", "6_rect_og_image", "crops"]
+
+# The rectangle images (5 and 6) are shrunk by OVERLAY_SCALE, e.g. 0.25 for a
+# quarter size preview that is much quicker to draw and write out. 1 keeps them
+# at full size.
+OVERLAY_SCALE = 1.0
+
+# Debug images are saved as DEBUG_IMAGE_FORMAT (".bmp", ".png" or ".jpg"), using
+# DEBUG_PNG_COMPRESSION (0-9) or DEBUG_JPEG_QUALITY (0-100). They are written on a
+# background thread, with up to DEBUG_QUEUE_SIZE images waiting at a time. If the
+# queue is full, the analysis waits for room unless DEBUG_DROP_WHEN_FULL is True,
+# in which case the image is skipped.
+DEBUG_IMAGE_FORMAT = ".bmp"
+DEBUG_PNG_COMPRESSION = 3
+DEBUG_JPEG_QUALITY = 95
+DEBUG_QUEUE_SIZE = 16
+DEBUG_DROP_WHEN_FULL = False
+
+# Number of processes to analyse images with at the same time. 1 analyses the
+# images one after another, 0 uses every core of the computer.
+NUM_WORKERS = 1
+
+# Number of images read ahead of the ones being analysed, on PREFETCH_THREADS
+# threads, so the analysis does not wait on the disk (0 reads nothing ahead).
+# With more than one worker, images are read ahead as files and decoded by the
+# worker that analyses them.
+PREFETCH_FRAMES = 2
+PREFETCH_THREADS = 2
+
+# Folder to keep the particles found in each image in, so rerunning the same
+# images with the same detection settings (CACHE_KEY_SETTINGS) skips the image
+# processing. Measurements depending on the particle height or the pixel size are
+# worked out again from the cached particles. "" turns the cache off. The files
+# used longest ago are deleted once the cache grows past RESULT_CACHE_MAX_MB.
+# The cache is only used while crops are not saved: TEST = False, or "crops"
+# taken out of DEBUG_STAGES.
+RESULT_CACHE_PATH = ""
+RESULT_CACHE_MAX_MB = 1024
+
+# Tracking toggle. If True, every particle is compared against the particles of
+# the last TRACK_WINDOW images as it is written out. Particles within
+# POSITIONAL_REMOVAL_RANGE pixels and AREA_REMOVAL_RANGE of an earlier one share
+# its Track_ID and are marked as a Repeat. Once MAX_PERCENT_REMOVED percent of
+# the particles are repeats, a warning to clean the flowcell is printed straight
+# away. The three ranges are the ones set in repeatParticleRemoval.py.
+TRACK_PARTICLES = False
+TRACK_WINDOW = 5
+
+# Watch toggle. If True, keeps watching IMAGE_FOLDER_PATH and analyses new images
+# as soon as the instrument has finished writing them, instead of analysing the
+# folder once. Watching ends when a file named WATCH_SENTINEL appears in the
+# folder or when no new image arrives for WATCH_TIMEOUT seconds (0 never times out).
+WATCH_FOLDER = False
+WATCH_POLL_INTERVAL = 1.0
+WATCH_SENTINEL = "STOP"
+WATCH_TIMEOUT = 600
+
+# Settings handed to every worker process so they analyse images exactly the
+# same way as a single process would
+WORKER_SETTINGS = ["PROJECTED_PIXEL_SIZE", "CLARITY_THRESHOLD", "AREA_THRESHOLD_MIN",
+                   "AREA_THRESHOLD_MAX", "AVG_PARTICLE_HEIGHT", "IMAGE_FOLDER_PATH",
+                   "TEST_RESULTS_PATH", "CUSTOM_THRESH", "THRESH_PARAM", "CLARITY_MEASURE",
+                   "FOCUS_RING", "CLAHE_CELL_SIZE", "TILED", "TILE_SIZE", "TILE_HALO",
+                   "TILE_THREADS", "DENOISE_METHOD",
+                   "DENOISE_ROI_ONLY", "DENOISE_ROI_PADDING", "TEST", "COLLECT_METRICS", "DEBUG_STAGES",
+                   "DEBUG_IMAGE_FORMAT", "DEBUG_PNG_COMPRESSION", "DEBUG_JPEG_QUALITY",
+                   "DEBUG_QUEUE_SIZE", "DEBUG_DROP_WHEN_FULL", "OVERLAY_SCALE",
+                   "RESULT_CACHE_PATH", "RESULT_CACHE_MAX_MB"]
+
+# Settings that change which particles are found in an image or their areas,
+# coordinates and focus measures. Cached particles are only reused if all of
+# them are the same as when they were cached.
+CACHE_KEY_SETTINGS = ["CLARITY_THRESHOLD", "AREA_THRESHOLD_MIN", "AREA_THRESHOLD_MAX",
+                      "CROP_BORDER_WIDTH", "CUSTOM_THRESH", "THRESH_PARAM", "CLARITY_MEASURE",
+                      "FOCUS_RING", "CLAHE_CELL_SIZE", "TILED", "TILE_SIZE", "TILE_HALO",
+                      "DENOISE_METHOD", "DENOISE_ROI_ONLY", "DENOISE_ROI_PADDING"]
+
 ################################## MAIN CODE  #####################################
-def main():
+# The whole analysis of IMAGE_FOLDER_PATH. Asks for the average particle height
+# first if ask_height is True, otherwise AVG_PARTICLE_HEIGHT is used as it is.
+def main(ask_height = True):
     # Make sure that the optimized version of the code in cv2 is used here
     cv2.setUseOptimized(True)
 
     # Create test image folder
     pathlib.Path(TEST_RESULTS_PATH).mkdir(exist_ok = True)
-    pathlib.Path(TEST_RESULTS_PATH + "/crops").mkdir(exist_ok = True)
 
-    # Set up the excel file to be modified and set the row in the excel file
-    # to start writing at
-    workbook, xl_sheet_data, xl_sheet_summary = setup_xl_file()
-    num_particles = 0
-    startRow = 1
+    # Set up the results file to write to. Rows are flushed to disk as they are
+    # written when watching so memory stays flat however long the test runs.
+    sink = open_result_sink(RESULTS_FILENAME, constant_memory = WATCH_FOLDER, formulas = SUMMARY_FORMULAS)
+    crop_archive = CropArchiveWriter(TEST_RESULTS_PATH + "/crops") if saving_crops(script_config()) else None
+    tracker = None
+    if TRACK_PARTICLES:
+        tracker = ParticleTracker(repeatParticleRemoval.POSITIONAL_REMOVAL_RANGE,
+                                  repeatParticleRemoval.AREA_REMOVAL_RANGE, TRACK_WINDOW)
 
     # Optionally have user input an estimate for particle height
-    request_height()
+    if ask_height:
+        request_height()
 
-    # Make a list of file names in the directory to test and sort them
-    file_list = [x for x in os.listdir(IMAGE_FOLDER_PATH) if not os.path.isdir(os.path.join(IMAGE_FOLDER_PATH, x))]
+    start_time = time.perf_counter()
+    if WATCH_FOLDER:
+        watch_folder(sink, crop_archive, tracker)
+    else:
+        analyse_folder(sink, crop_archive, tracker)
+
+    if tracker is not None:
+        print(str(tracker.num_repeats) + " of " + str(tracker.num_particles) + " particles (" +
+              str(round(tracker.percent_repeats(), 2)) + "%) were repeats of particles in earlier images")
+
+    # Finish off the results file, the crops and the debug images
+    close_start_time = time.perf_counter()
+    sink.close()
+    if crop_archive is not None:
+        crop_archive.close()
+    close_image_writer()
+
+    if COLLECT_METRICS:
+        end_time = time.perf_counter()
+        run_values = {"images": len(runMetrics.records), "particles": sink.num_rows,
+                      "total_seconds": end_time - start_time,
+                      "results_close_seconds": end_time - close_start_time,
+                      "main_peak_rss_mb": runMetrics.peak_rss_mb()}
+        if tracker is not None:
+            run_values["repeat_percent"] = tracker.percent_repeats()
+        metrics_filename = pathlib.Path(RESULTS_FILENAME)
+        metrics_filename = metrics_filename.with_name(metrics_filename.stem + "_metrics" + METRICS_FORMAT)
+        runMetrics.write_report(metrics_filename, run_values)
+        runMetrics.print_summary(run_values)
+
+    if EXPORT_EXCEL and pathlib.Path(RESULTS_FILENAME).suffix.lower() != ".xlsx":
+        export_excel(RESULTS_FILENAME, pathlib.Path(RESULTS_FILENAME).with_suffix(".xlsx"), SUMMARY_FORMULAS)
+
+
+# Make a sorted list of the image file names in IMAGE_FOLDER_PATH
+def find_image_files():
+    file_list = sorted(x for x in os.listdir(IMAGE_FOLDER_PATH) if not os.path.isdir(os.path.join(IMAGE_FOLDER_PATH, x)))
+
+    # Skip over any non-image files
+    return [x for x in file_list if x.endswith(".bmp")]
+
+
+# Test all images within the folder designated by IMAGE_FOLDER_PATH, along
+# with every frame of the raw stacks and multi-page TIFF files in it, in
+# parallel if more than one worker is requested, and write the results to sink.
+# Either way the results come back in file order so the rows are numbered the same.
+def analyse_folder(sink, crop_archive, tracker):
+    frame_list = frameSource.find_frames(IMAGE_FOLDER_PATH)
+
+    num_workers = NUM_WORKERS if NUM_WORKERS > 0 else multiprocessing.cpu_count()
+    if num_workers == 1 or len(frame_list) < 2:
+        for frame, reading in frameSource.prefetch_frames(frame_list, read_frame, PREFETCH_FRAMES, PREFETCH_THREADS):
+            save_table(analyse_frame(frame, reading), sink, crop_archive, tracker)
+    else:
+        # Workers get the file of each single image as it was read ahead, or only
+        # the file name and frame number of stack frames, which they map or read
+        # themselves. Only as many images as there are workers plus
+        # PREFETCH_FRAMES are handed out at a time, to cap the memory they take up.
+        settings = {name: globals()[name] for name in WORKER_SETTINGS}
+        num_workers = min(num_workers, len(frame_list))
+        with multiprocessing.Pool(num_workers, init_worker, (settings,)) as pool:
+            pending = collections.deque()
+            for frame, reading in frameSource.prefetch_frames(frame_list, read_encoded_frame,
+                                                              PREFETCH_FRAMES, PREFETCH_THREADS):
+                pending.append(pool.apply_async(analyse_frame, (frame, reading.result())))
+                if len(pending) >= num_workers + PREFETCH_FRAMES:
+                    save_table(pending.popleft().get(), sink, crop_archive, tracker)
+            while pending:
+                save_table(pending.popleft().get(), sink, crop_archive, tracker)
+            pool.close()
+            pool.join()
+
+
+# Keep analysing the images written into IMAGE_FOLDER_PATH as they arrive, in
+# file order, until the sentinel file shows up or no new image has arrived for
+# WATCH_TIMEOUT seconds. Rows are written to sink and a running summary is
+# printed after every image.
+def watch_folder(sink, crop_archive, tracker):
+    print("Watching " + IMAGE_FOLDER_PATH + " for new images. Create a file named " +
+          WATCH_SENTINEL + " in it to stop.")
+    done = set()
+    file_sizes = {}
+    num_images = 0
+    last_image_time = time.time()
+
+    while True:
+        # Once the sentinel exists the instrument has stopped writing, so every
+        # image left in the folder is complete
+        stopping = os.path.exists(os.path.join(IMAGE_FOLDER_PATH, WATCH_SENTINEL))
+
+        for file_name in find_written_images(done, file_sizes, stopping):
+            table = analyse_file(file_name)
+            save_table(table, sink, crop_archive, tracker)
+            done.add(file_name)
+            last_image_time = time.time()
+
+            num_images = num_images + 1
+            if sink.summary.count > 0:
+                print("Running summary: " + str(num_images) + " images, " + str(sink.summary.count) +
+                      " particles, AVG_PIXEL_AREA = " + str(sink.summary.value("AVERAGE", "Pixel_Area")) +
+                      ", AVG_PIXEL_DIAMETER = " + str(sink.summary.value("AVERAGE", "Pixel_Diameter")) +
+                      ", SAUTER_MEAN_DIAMETER = " + str(sink.summary.value("SAUTER", "Sauter_Diameter")) +
+                      (", REPEATS = " + str(round(tracker.percent_repeats(), 2)) + "%" if tracker is not None else ""))
+
+        if stopping:
+            print("Found " + WATCH_SENTINEL + ", stopped watching.")
+            break
+        if WATCH_TIMEOUT > 0 and time.time() - last_image_time > WATCH_TIMEOUT:
+            print("No new images for " + str(WATCH_TIMEOUT) + " seconds, stopped watching.")
+            break
+
+        time.sleep(WATCH_POLL_INTERVAL)
+
+
+# Find the images in IMAGE_FOLDER_PATH that have not been analysed yet and are
+# completely written, meaning their size has not changed since the last check.
+# file_sizes remembers the sizes seen at the last check. If all_written is True
+# every new image is taken as complete.
+def find_written_images(done, file_sizes, all_written):
+    written = []
+    for file_name in find_image_files():
+        if file_name in done:
+            continue
 
-    # Test all images within the folder designated by IMAGE_FOLDER_PATH
-    # for file_name in os.listdir(IMAGE_FOLDER_PATH):
-    for file_name in file_list:
-        # Skip over any non-image files
-        if not file_name.endswith(".bmp"):
+        try:
+            size = os.path.getsize(os.path.join(IMAGE_FOLDER_PATH, file_name))
+        except OSError:
             continue
 
-        print(file_name)
-        img = cv2.imread(os.path.join(IMAGE_FOLDER_PATH, file_name))
-        num_particles = analyse(img, startRow, os.path.splitext(file_name)[0], xl_sheet_data)
-        startRow = startRow + num_particles
-        clear_lists()
+        if all_written or (size > 0 and file_sizes.get(file_name) == size):
+            written.append(file_name)
+            file_sizes.pop(file_name, None)
+        else:
+            file_sizes[file_name] = size
+
+    return written
+
+
+# Write the rows of an analysed image to sink and its crops to crop_archive, if
+# crops are being saved. Crops are only kept until they are written. Particles
+# are tracked first if a tracker is given, so their track columns are written
+# with them. The time taken is added to the image's metrics.
+def save_table(table, sink, crop_archive, tracker):
+    runMetrics.resume_image(table.metrics)
+    if tracker is not None:
+        with runMetrics.stage("tracking"):
+            tracker.track(table)
+        warn_if_dirty(tracker)
+    with runMetrics.stage("results_write"):
+        sink.write(table)
+    if crop_archive is not None and table.crops is not None:
+        with runMetrics.stage("crop_archive"):
+            crop_archive.write(table.file_name, table.crops)
+        table.crops = None
+
+    if table.cache_key is not None:
+        with runMetrics.stage("cache_write"):
+            get_result_cache().put(table.cache_key, table)
+        table.cache_key = None
+
+    runMetrics.add_record(runMetrics.end_image())
+    table.metrics = None
+
+
+# Warn once, as soon as it happens, that enough of the particles are repeats for
+# the flowcell to need cleaning, so the run can be stopped early
+def warn_if_dirty(tracker):
+    if not tracker.warned and tracker.is_dirty(repeatParticleRemoval.MAX_PERCENT_REMOVED):
+        tracker.warned = True
+        print("WARNING: The flowcell is dirty and " + str(round(tracker.percent_repeats(), 2)) +
+              "% of particles so far are repeats.")
+        print("Please consider cleaning and starting anew.")
+
+
+# Set up a worker process of the pool with the settings of the main process.
+# OpenCV is limited to one thread per worker since the pool already keeps every
+# core busy.
+def init_worker(settings):
+    globals().update(settings)
+    cv2.setUseOptimized(True)
+    cv2.setNumThreads(1)
 
-    # Write out the summary sheet in the excel workbook, and clear out crops list
-    write_xl_summaries(startRow, workbook, xl_sheet_data, xl_sheet_summary)
-    crops.clear()
-    workbook.close()
 
+# Read and analyse a single image file from IMAGE_FOLDER_PATH. Returns the
+# ParticleTable of the image.
+def analyse_file(file_name):
+    return analyse_frame((file_name, None))
 
-# General analysing function. Returns the number of particles successfully
-# analysed.
-def analyse(img, startRow, file_name, xl_sheet_data):
-    test_img(file_name + "_1_original", img)
 
-    img = crop_left_border(img)
+# Read a frame found by frameSource.find_frames, given as a (file_name,
+# frame_index) pair
+def read_frame(frame):
+    return frameSource.read_frame(IMAGE_FOLDER_PATH, frame[0], frame[1])
 
-    sobel_img, clahe_img = apply_filters(file_name, img)
 
-    thresh_img = threshold_make_binary(clahe_img)
+# Read the file of a frame without decoding it, see frameSource.read_encoded_frame
+def read_encoded_frame(frame):
+    return frameSource.read_encoded_frame(IMAGE_FOLDER_PATH, frame[0], frame[1])
 
-    # Calculate areas and diameters for the particles, both with the contours
-    # and by manually counting the pixels
-    calc_areas(sobel_img, thresh_img, file_name, img)
-    calc_diameters()
 
-    # Find the length of the major and minor axis, the aspect ratios, as well as eccentricity,
-    # or how circular the ellipse is (keep in mind, this is merely a cross-section). The closer
-    # to 0, the more circular.
-    find_side_related_measures()
+# Read and analyse a frame found by frameSource.find_frames, given as a
+# (file_name, frame_index) pair, with the settings of this script. Returns the
+# ParticleTable of the frame. A frame already being read ahead is handed over as
+# reading: either the future of read_frame, or the encoded file from
+# read_encoded_frame. The read stage of the metrics is the time spent waiting for
+# and decoding it. Frames found in the result cache are not analysed again, and
+# get no debug images.
+def analyse_frame(frame, reading = None):
+    config = script_config()
+    file_name, frame_index = frame
+    name = frameSource.frame_name(file_name, frame_index)
+    print(file_name if frame_index is None else file_name + " frame " + str(frame_index))
+    if COLLECT_METRICS:
+        runMetrics.begin_image(name)
+
+    with runMetrics.stage("read"):
+        if isinstance(reading, concurrent.futures.Future):
+            img = reading.result()
+        else:
+            img = frameSource.read_frame(IMAGE_FOLDER_PATH, file_name, frame_index, reading)
+
+    # Cached particles have no crops, so the cache is neither read nor written
+    # while crops are saved
+    cache = get_result_cache()
+    cache_key = None
+    if cache is not None and not saving_crops(config):
+        with runMetrics.stage("cache_read"):
+            cache_key = cache.key(img, cache_settings())
+            table = cache.get(cache_key, name)
+
+        if table is not None:
+            print("Reusing the cached particles of " + name)
+            runMetrics.note("cached", 1)
+            with runMetrics.stage("measurement"):
+                calc_geometry(table.data, table.rects[:, 2:4], config)
+            table.metrics = runMetrics.end_image()
+            return table
+
+    table = analyse(img, name, config)
+    table.cache_key = cache_key
+    table.metrics = runMetrics.end_image()
+
+    return table
+
+
+# The settings of one analysis, to be handed to analyse_image(). Holds a value for
+# every name in WORKER_SETTINGS: those given as keyword arguments, e.g.
+# AnalysisConfig(THRESH_PARAM = 60, AVG_PARTICLE_HEIGHT = 5.0), and otherwise
+# the values at the top of this script, except that no debug images are written
+# unless TEST and DEBUG_STAGES are given.
+class AnalysisConfig(dict):
+    def __init__(self, **settings):
+        unknown = [name for name in settings if name not in WORKER_SETTINGS]
+        if unknown:
+            raise ValueError("Unknown analysis settings: " + ", ".join(sorted(unknown)))
+
+        dict.__init__(self, {name: globals()[name] for name in WORKER_SETTINGS})
+        self["TEST"] = False
+        self["DEBUG_STAGES"] = []
+        self.update(settings)
+
+    # A copy of this config with some of its settings changed
+    def replace(self, **settings):
+        return AnalysisConfig(**dict(self, **settings))
+
+
+# The AnalysisConfig of the settings at the top of this script as they are now,
+# debug images included
+def script_config():
+    return AnalysisConfig(**{name: globals()[name] for name in WORKER_SETTINGS})
+
+
+# Analyse an image already in memory (a BGR or grayscale array) with the settings
+# of config, an AnalysisConfig, without asking for anything or touching the
+# settings of this script. Returns the ParticleTable of the image, named
+# file_name. Images can be analysed at the same time from different threads.
+def analyse_image(img, config = None, file_name = "image"):
+    if config is None:
+        config = AnalysisConfig()
+
+    return analyse(img, file_name, config)
+
+
+# General analysing function. Returns a ParticleTable holding the measurements
+# of every particle successfully analysed, using the settings of config, an
+# AnalysisConfig, or the settings of this script if it is not given. Nothing is
+# shared between calls, so images can be analysed at the same time from
+# different threads or processes.
+def analyse(img, file_name, config = None):
+    if config is None:
+        config = script_config()
+    check_image_size(img.shape[0], img.shape[1], file_name)
+
+    runMetrics.note("height", img.shape[0])
+    runMetrics.note("width", img.shape[1])
+    if config["TILED"] and max(img.shape[:2]) > config["TILE_SIZE"]:
+        return analyse_tiled(img, file_name, config)
+
+    test_img(file_name, "1_original", img, config)
+
+    with runMetrics.stage("crop"):
+        img = crop_left_border(img)
+
+    sobel_img, laplacian_img, clahe_img = apply_filters(file_name, img, config)
+
+    with runMetrics.stage("threshold"):
+        thresh_img = threshold_make_binary(clahe_img, config)
+
+    # Calculate areas for the particles, both with the contours and by manually
+    # counting the pixels, then derive every other measurement from them
+    with runMetrics.stage("contours"):
+        contours, labels, stats = find_particles(thresh_img, config)
+    with runMetrics.stage("measurement"):
+        table = calc_areas(sobel_img, laplacian_img, thresh_img, contours, labels, stats, file_name, config)
+        calc_geometry(table.data, table.rects[:, 2:4], config)
+
+    with runMetrics.stage("overlay"):
+        draw_rect_img(thresh_img, img, contours, file_name, table, config)
+
+    return table
+
+
+# Raise a ValueError if an image of the given size has nothing left to analyse
+# once the left border is cropped off. OpenCV's CLAHE never returns on an empty
+# image, so these have to be caught before the analysis starts.
+def check_image_size(height, width, file_name):
+    if height < 1 or width <= CROP_BORDER_WIDTH:
+        raise ValueError("The image " + file_name + " is " + str(width) + "x" + str(height) +
+                         " pixels, it has to be wider than " + str(CROP_BORDER_WIDTH) + " pixels")
+
+
+# Analyse an image a tile at a time, see TILED. Returns the same ParticleTable
+# as analyse() would, with the particles ordered tile by tile.
+def analyse_tiled(img, file_name, config):
+    with runMetrics.stage("crop"):
+        img = crop_left_border(img)
+
+    tiles = find_tiles(img.shape[0], img.shape[1], config)
+    runMetrics.note("tiles", len(tiles))
+
+    num_threads = config["TILE_THREADS"] if config["TILE_THREADS"] > 0 else multiprocessing.cpu_count()
+    with concurrent.futures.ThreadPoolExecutor(num_threads) as executor:
+        # Every tile has to use the Otsu threshold of the whole image, which is
+        # found from the histograms of the contrast-evened cores of all tiles
+        if not config["CUSTOM_THRESH"]:
+            hist = sum(executor.map(lambda tile: tile_histogram(img, tile[0], tile[1], config), tiles))
+            level = otsu_level(hist)
+            runMetrics.note("otsu_threshold", level)
+            config = config.replace(CUSTOM_THRESH = True, THRESH_PARAM = level)
+
+        tables = list(executor.map(lambda tile: analyse_tile(img, file_name, tile[0], tile[1], config), tiles))
+
+    return ParticleTable.concatenate(file_name, tables)
+
+
+# Split an image of the given size into tiles. Returns a list of (core, region)
+# pairs, both (x0, y0, x1, y1) rectangles: the core is the part of the image the
+# tile is responsible for and the region the core along with its halo. Tiles
+# start on whole CLAHE regions so every tile evens out the contrast exactly the
+# same way as the whole image would.
+def find_tiles(height, width, config):
+    cell_size = clahe_cell_size(config)
+    tile_size = -(-config["TILE_SIZE"] // cell_size) * cell_size
+    halo = -(-config["TILE_HALO"] // cell_size) * cell_size
+
+    tiles = []
+    for y0 in range(0, height, tile_size):
+        for x0 in range(0, width, tile_size):
+            core = (x0, y0, min(x0 + tile_size, width), min(y0 + tile_size, height))
+            region = (max(x0 - halo, 0), max(y0 - halo, 0),
+                      min(x0 + tile_size + halo, width), min(y0 + tile_size + halo, height))
+            tiles.append((core, region))
+
+    return tiles
+
+
+# Histogram of the core of a tile once its region has been grayscaled and had
+# its contrast increased, the same pixels the whole image would be thresholded on
+def tile_histogram(img, core, region, config):
+    x0, y0, x1, y1 = region
+    with runMetrics.stage("grayscale"):
+        gray_img = grayscale(img[y0 : y1, x0 : x1])
+    with runMetrics.stage("clahe"):
+        clahe_img = increase_contrast(gray_img, config)
+    with runMetrics.stage("threshold"):
+        core_img = clahe_img[core[1] - y0 : core[3] - y0, core[0] - x0 : core[2] - x0]
+        hist = np.bincount(core_img.ravel(), minlength = 256)
+
+    return hist
 
-    # Find the surface areas, volumes, and sauter diameters if the user provides
-    # an estimate for the average height of all the particles
-    find_height_dependent_measures()
 
-    write_data_to_excel(file_name, startRow, xl_sheet_data)
+# Analyse the region of a tile, keeping only the particles whose bounding
+# rectangles start in its core. Coordinates are moved back onto the whole image.
+def analyse_tile(img, file_name, core, region, config):
+    x0, y0, x1, y1 = region
+    tile_img = img[y0 : y1, x0 : x1]
+    tile_name = file_name + "_tile_" + str(x0) + "_" + str(y0)
+    test_img(tile_name, "1_original", tile_img, config)
 
-    return len(auto_areas)
+    sobel_img, laplacian_img, clahe_img = apply_filters(tile_name, tile_img, config)
+    with runMetrics.stage("threshold"):
+        thresh_img = threshold_make_binary(clahe_img, config)
+
+    with runMetrics.stage("contours"):
+        contours, labels, stats = find_particles(thresh_img, config)
+    core = (core[0] - x0, core[1] - y0, core[2] - x0, core[3] - y0)
+    with runMetrics.stage("measurement"):
+        table = calc_areas(sobel_img, laplacian_img, thresh_img, contours, labels, stats, file_name, config, core)
+        calc_geometry(table.data, table.rects[:, 2:4], config)
+
+    with runMetrics.stage("overlay"):
+        draw_rect_img(thresh_img, tile_img, contours, tile_name, table, config)
+
+    table.rects[:, 0] = table.rects[:, 0] + x0
+    table.rects[:, 1] = table.rects[:, 1] + y0
+    table["X_coord"] = table.rects[:, 0]
+    table["Y_coord"] = table.rects[:, 1]
+
+    return table
 
 
 # Apply multiple filters such as grayscale, denoising, clahe, and sobel to the original
-# image and return the sobel and clahe results
-def apply_filters(file_name, img):
+# image and return the sobel, laplacian and clahe results
+def apply_filters(file_name, img, config):
     # Applying a variety of edits and filters to make size calculations easier
-    gray_img = grayscale(img)
-    test_img(file_name + "_2_gray", gray_img)
-    denoise_img = denoise(gray_img)
-    test_img(file_name + "_3_denoised", denoise_img)
+    with runMetrics.stage("grayscale"):
+        gray_img = grayscale(img)
+    test_img(file_name, "2_gray", gray_img, config)
+    with runMetrics.stage("clahe"):
+        clahe_img = increase_contrast(gray_img, config)
+
+    # The Sobel image is only ever looked at inside the bounding rectangles of
+    # the particles, so those are all that needs denoising in ROI mode
+    with runMetrics.stage("denoise"):
+        if config["DENOISE_ROI_ONLY"]:
+            regions = find_denoise_regions(threshold_make_binary(clahe_img, config), config)
+            runMetrics.note("denoise_regions", len(regions))
+            denoise_img = denoise_regions(gray_img, regions, config)
+        else:
+            denoise_img = denoise(gray_img, config)
+    test_img(file_name, "3_denoised", denoise_img, config)
 
-    # Increase contrast on denoised image and grayscale image using CLAHE
-    clahe_denoise_img = increase_contrast(denoise_img)
-    clahe_img = increase_contrast(gray_img)
-    test_img(file_name + "_4_clahe_denoise", clahe_denoise_img)
+    # Increase contrast on denoised image using CLAHE
+    with runMetrics.stage("clahe"):
+        clahe_denoise_img = increase_contrast(denoise_img, config)
+    test_img(file_name, "4_clahe_denoise", clahe_denoise_img, config)
 
     # Used later once bounded rectangles are drawn for determining if the particles
     # are in focus or not.
-    sobel_img = sobel_filter(clahe_denoise_img)
+    with runMetrics.stage("sobel"):
+        sobel_img = sobel_filter(clahe_denoise_img)
+    with runMetrics.stage("laplacian"):
+        laplacian_img = laplacian_filter(clahe_denoise_img)
 
-    return sobel_img, clahe_img
+    return sobel_img, laplacian_img, clahe_img
 
 
 
 # Crop the thin left border off the image and then grayscale to analyse further
 def crop_left_border(img):
     width = img.shape[1]
-    img = img[:,11:]
+    img = img[:,CROP_BORDER_WIDTH:]
 
     return img
 
 
 # Grayscale the image
 def grayscale(img):
+    # Frames from grayscale cameras already are
+    if img.ndim == 2:
+        return img
+
     return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
 
-# Denoise the image so the particles become more clear
-def denoise(img):
-    denoise_img = cv2.fastNlMeansDenoising(img, 7, 7, 7)
+# Denoise the image so the particles become more clear, using the filter picked
+# by DENOISE_METHOD
+def denoise(img, config):
+    if config["DENOISE_METHOD"] == "nlmeans":
+        denoise_img = cv2.fastNlMeansDenoising(img, 7, 7, 7)
+    elif config["DENOISE_METHOD"] == "bilateral":
+        denoise_img = cv2.bilateralFilter(img, 7, 50, 7)
+    elif config["DENOISE_METHOD"] == "median":
+        denoise_img = cv2.medianBlur(img, 5)
+    elif config["DENOISE_METHOD"] == "none":
+        denoise_img = img
+    else:
+        raise ValueError("Unknown DENOISE_METHOD: " + str(config["DENOISE_METHOD"]))
+
+    return denoise_img
+
+
+# Find the regions of the image worth denoising: the bounding rectangles of every
+# particle that passes the area and edge checks, padded by DENOISE_ROI_PADDING so
+# the filters see the same neighbourhood as they would on the whole image.
+# Returns an array of (x0, y0, x1, y1) rows clipped to the image.
+def find_denoise_regions(thresh_img, config):
+    labels, stats, centroids = label_particles(thresh_img)
+    stats = stats[1:]
+    height, width = thresh_img.shape
+    candidates = acceptable_particles(stats[:, cv2.CC_STAT_AREA], stats[:, :cv2.CC_STAT_AREA],
+                                      width - 2, height - 2, config)
+
+    x, y, w, h = stats[candidates, :cv2.CC_STAT_AREA].T
+    padding = config["DENOISE_ROI_PADDING"]
+    regions = np.column_stack((x - padding, y - padding, x + w + padding, y + h + padding))
+    np.clip(regions, 0, [width, height, width, height], out = regions)
+
+    return regions
+
+
+# Denoise only the given regions of the image, leaving the rest of it as is.
+# Regions that overlap are simply denoised again from the original pixels.
+def denoise_regions(img, regions, config):
+    denoise_img = img.copy()
+    for x0, y0, x1, y1 in regions:
+        denoise_img[y0 : y1, x0 : x1] = denoise(img[y0 : y1, x0 : x1], config)
 
     return denoise_img
 
 
 # Use CLAHE (Contrast Limited Adaptive Histogram Equalization) to increase the
 # image's contrast.
-def increase_contrast(img):
-    clahe = cv2.createCLAHE(clipLimit=2.0,)
-    clahe_img = clahe.apply(img)
+def increase_contrast(img, config):
+    if config["CLAHE_CELL_SIZE"] <= 0 and not config["TILED"]:
+        clahe = cv2.createCLAHE(clipLimit=2.0,)
+        clahe_img = clahe.apply(img)
+
+        return clahe_img
+
+    # Use regions of a fixed size, starting from the top left corner. The image
+    # is padded out to whole regions at the bottom and right.
+    cell_size = clahe_cell_size(config)
+    height, width = img.shape
+    padded_img = cv2.copyMakeBorder(img, 0, -height % cell_size, 0, -width % cell_size,
+                                    cv2.BORDER_REFLECT_101)
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize = (padded_img.shape[1] // cell_size,
+                                                           padded_img.shape[0] // cell_size))
+    clahe_img = clahe.apply(padded_img)[:height, :width]
 
     return clahe_img
 
 
+# The size of the CLAHE regions when they have a fixed size
+def clahe_cell_size(config):
+    return config["CLAHE_CELL_SIZE"] if config["CLAHE_CELL_SIZE"] > 0 else 250
+
+
 # Utilize the Sobel filter, a joint Gaussian smoothing and differentiation
 # operation, to make the image more resistant to noise.
 # Helps determine whether the particle is in focus or not.
@@ -191,10 +791,18 @@ def sobel_filter(img):
     return sobel_img
 
 
+# Apply the Laplacian, the second derivative of the image. How much it varies
+# over a particle is another measure of how sharp the particle is.
+def laplacian_filter(img):
+    laplacian_img = cv2.Laplacian(img, cv2.CV_32F, ksize = 3)
+
+    return laplacian_img
+
+
 # Simple thresholding, basically making the image binary
-def threshold_make_binary(img):
-    if CUSTOM_THRESH:
-        retval, thresh_img = cv2.threshold(img, THRESH_PARAM, 255, cv2.THRESH_BINARY_INV)
+def threshold_make_binary(img, config):
+    if config["CUSTOM_THRESH"]:
+        retval, thresh_img = cv2.threshold(img, config["THRESH_PARAM"], 255, cv2.THRESH_BINARY_INV)
     else:
         # Utilize the automatic optimum Otsu Algorithm
         retval, thresh_img = cv2.threshold(img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
@@ -202,146 +810,258 @@ def threshold_make_binary(img):
     return thresh_img
 
 
-# Draws bounded rectangles around particles of interest and ignores unnecessary
-# content we don't want to analyse in the image, such as particles that are
-# too transparent or too close to the edge.
-def calc_areas(sobel_img, thresh_img, file_name, img):
-    # Plan to modify this global variable
-    global filtered_min_area_rects
+# The threshold cv2.threshold picks with THRESH_OTSU for an image with the given
+# 256 bin histogram, so the threshold of a whole image can be found from the
+# histograms of its tiles. Follows OpenCV's own search step for step.
+def otsu_level(hist):
+    scale = 1.0 / hist.sum()
+    mu = sum(i * int(hist[i]) for i in range(256)) * scale
+    epsilon = float(np.finfo(np.float32).eps)
+    mu1 = 0.0
+    q1 = 0.0
+    max_sigma = 0.0
+    level = 0
+    for i in range(256):
+        p_i = int(hist[i]) * scale
+        mu1 *= q1
+        q1 += p_i
+        q2 = 1.0 - q1
+        if min(q1, q2) < epsilon or max(q1, q2) > 1.0 - epsilon:
+            continue
+
+        mu1 = (mu1 + i * p_i) / q1
+        mu2 = (mu - q1 * mu1) / q2
+        sigma = q1 * q2 * (mu1 - mu2) ** 2
+        if sigma > max_sigma:
+            max_sigma = sigma
+            level = i
 
-    # Used to later manually pixel count
-    thresh_rgb_img = cv2.cvtColor(thresh_img, cv2.COLOR_GRAY2BGR)
+    return level
 
-    __, contours, hierarchy = cv2.findContours(thresh_img, cv2.RETR_EXTERNAL,
-                              cv2.CHAIN_APPROX_SIMPLE);
 
-    # Create a list of bounding rectangles and rotated rectangles to later
-    # filter and analyse for area
-    all_bound_rects = []
-    min_area_rects = []
-    for contour in contours:
-        all_bound_rects.append(cv2.boundingRect(contour))
-        min_area_rects.append(cv2.minAreaRect(contour))
+# Label every particle at once to get the pixel areas and bounding rectangles of
+# all of them in a single pass over the image, then find the outer contour of
+# every particle that could still be measured. Specks that fail the area check
+# and are too small to surround another particle are left out of the contour
+# search, as noisy images can have tens of thousands of them. Returns the
+# contours, the label image and the stats of each label.
+def find_particles(thresh_img, config):
+    labels, stats, centroids = label_particles(thresh_img)
 
-    print("Total Number of Contours (Pre-Elimination) = " + str(len(contours)))
+    print("Total Number of Contours (Pre-Elimination) = " + str(len(stats) - 1))
+    runMetrics.add("contours", len(stats) - 1)
+
+    traced = traced_labels(thresh_img, stats, config)
+    if traced[1:].all():
+        contour_img = thresh_img
+    else:
+        contour_img = np.where(traced, 255, 0).astype(np.uint8)[labels]
+    contours, hierarchy = cv2.findContours(contour_img, cv2.RETR_EXTERNAL,
+                          cv2.CHAIN_APPROX_SIMPLE)[-2:]
+    runMetrics.add("traced_contours", len(contours))
+
+    return contours, labels, stats
+
+
+# Decide which labels to find the contours of, as a boolean array indexed by
+# label: every particle passing the area and edge checks, as well as any big
+# enough to surround one of them. The rest can never be measured, and since
+# they cannot surround anything, leaving them out does not change which of the
+# other contours are outer contours.
+def traced_labels(thresh_img, stats, config):
+    height, width = thresh_img.shape
+    areas = stats[:, cv2.CC_STAT_AREA]
+    traced = acceptable_particles(areas, stats[:, :cv2.CC_STAT_AREA], width - 2, height - 2, config)
+    traced = traced | (areas >= MIN_ENCLOSING_AREA)
+    traced[0] = False
+
+    return traced
+
+
+# Ignores unnecessary content we don't want to analyse in the image, such as
+# particles that are too transparent or too close to the edge. If core is given
+# as an (x0, y0, x1, y1) rectangle, only particles whose bounding rectangles
+# start inside it are kept. Returns a ParticleTable of the kept particles with
+# their areas, coordinates and minimum area rectangles filled in.
+def calc_areas(sobel_img, laplacian_img, thresh_img, contours, labels, stats, file_name, config, core = None):
+    contour_labels = find_contour_labels(contours, labels)
+    bound_rects = stats[contour_labels, :cv2.CC_STAT_AREA]
+    num_white_pixels = stats[contour_labels, cv2.CC_STAT_AREA]
+
+    # Measure how in focus every particle is, all in one pass over the image
+    focus = measure_focus(sobel_img, laplacian_img, labels, len(stats), config)
+    for name in FOCUS_COLUMNS:
+        focus[name] = focus[name][contour_labels]
 
     # Dimensions for future reference/calculations
-    height, width, channels = thresh_rgb_img.shape
+    height, width = thresh_img.shape
     xMax = width - 2
     yMax = height - 2
 
-    # Used to filter out unnecessary bounded rectangles
-    toKeep = []
-
-    for i in range(len(min_area_rects)):
-        #Crop out the area of interest with the individual particle to examine
-        center, size, angle = min_area_rects[i]
-
-        # Crop out the rectangles from the sobel image as well as the threshold image
-        x, y, w, h = all_bound_rects[i]
-        sobel_roi_crop = sobel_img[y : y + h, x: x + w]
-        threshold_roi_crop = thresh_img[y: y + h, x : x + w]
-
-        # Find the minimum and maximum of this current particle's ROI
-        (minval, maxval, minloc, maxloc) = cv2.minMaxLoc(sobel_roi_crop)
-
-        # Calculate manual-area by counting number of non-black (white) pixels
-        num_white_pixels = count_white_pixels(threshold_roi_crop)
-
-        # Determine whether or not to keep the particle we just cropped
-        kept = acceptable_particle(num_white_pixels, all_bound_rects[i],
-            xMax, yMax, maxval)
-        toKeep.append(kept)
-
-        if (kept):
-            # Calculate auto-generated area with contours
-            contour_area = cv2.contourArea(contours[i])
-            auto_areas.append(contour_area)
-            pixel_areas.append(num_white_pixels)
-
+    # Throw out every particle that is too small, too big or too close to the
+    # edge, as well as particles that are too transparent to measure accurately,
+    # before doing any work on the individual particles
+    candidates = acceptable_particles(num_white_pixels, bound_rects, xMax, yMax, config)
+    if core is not None:
+        x, y = bound_rects[:, 0], bound_rects[:, 1]
+        candidates = candidates & (x >= core[0]) & (y >= core[1]) & (x < core[2]) & (y < core[3])
+    kept = np.flatnonzero(candidates & (focus[config["CLARITY_MEASURE"]] > config["CLARITY_THRESHOLD"]))
+    runMetrics.add("candidates", int(np.count_nonzero(candidates)))
+    runMetrics.add("particles", len(kept))
+
+    auto_areas = []
+    pixel_areas = []
+    min_area_rects = []
+    crops = [] if saving_crops(config) else None
+    for i in kept:
+        label = contour_labels[i]
+        x, y, w, h = bound_rects[i]
+
+        # Calculate auto-generated area with contours
+        contour_area = cv2.contourArea(contours[i])
+        auto_areas.append(contour_area)
+        pixel_areas.append(num_white_pixels[i])
+        min_area_rects.append(cv2.minAreaRect(contours[i]))
+
+        # Only keep the pixels belonging to this particle in its crop
+        if crops is not None:
+            threshold_roi_crop = (labels[y : y + h, x : x + w] == label).astype(np.uint8) * 255
             crops.append(threshold_roi_crop)
-            # test_img("crops/"+file_name + "_crop_" + str(i), threshold_roi_crop)
 
 
     print("Total Number of Contours (Post-Elimination): " + str(len(auto_areas)))
 
-    filtered_min_area_rects = list(compress(min_area_rects, toKeep))
-
-    save_thresh_roi_crops()
-    draw_rect_img(thresh_rgb_img, img, contours, file_name)
-
-
-# Manually count the number of white pixels that are present in the threshold_roi_crop
-# from draw_bounded_rects
-def count_white_pixels(threshold_roi_crop):
-    num = 0
-    height, width = threshold_roi_crop.shape
-    for y in range(height):
-        for x in range(width):
-            if threshold_roi_crop[y][x] != 0:
-                num += 1
-
-    return num
+    table = ParticleTable.empty(file_name, len(min_area_rects))
+    table.crops = crops
+    table["Pixel_Area"] = pixel_areas
+    table["Contour_Area"] = auto_areas
+    for i, ((x, y), (width, height), angle) in enumerate(min_area_rects):
+        table.rects[i] = (x, y, width, height, angle)
+    table["X_coord"] = table.rects[:, 0]
+    table["Y_coord"] = table.rects[:, 1]
+    for name in FOCUS_COLUMNS:
+        table[name] = focus[name][kept]
+
+    return table
+
+
+# Label the connected white regions of the threshold image. Returns the label
+# image along with the stats (bounding rectangle and pixel area) and centroid
+# of every label, where label 0 is the background.
+def label_particles(thresh_img):
+    num_labels, labels, stats, centroids = cv2.connectedComponentsWithStats(
+        thresh_img, connectivity = 8)
+
+    return labels, stats, centroids
+
+
+# Find the label of the particle each contour outlines. Every point of an
+# external contour lies on its particle, so looking up the first one is enough.
+def find_contour_labels(contours, labels):
+    first_points = np.array([contour[0][0] for contour in contours], dtype = np.intp)
+    first_points = first_points.reshape(-1, 2)
+
+    return labels[first_points[:, 1], first_points[:, 0]]
+
+
+# Measure the focus of every label of the label image at once. Each particle is
+# grown by FOCUS_RING pixels first so the edges just outside it count, while
+# pixels of the particle itself always stay with it. Returns a dictionary of
+# arrays indexed by label, one for each of FOCUS_COLUMNS. The cost only depends
+# on the size of the image, not on how many particles are in it.
+def measure_focus(sobel_img, laplacian_img, labels, num_labels, config):
+    grown = labels
+    if config["FOCUS_RING"] > 0:
+        # Labels are exact in float32 up to 2^24, far more than fit in an image
+        kernel = np.ones((3, 3), np.uint8)
+        dilated = cv2.dilate(labels.astype(np.float32), kernel, iterations = config["FOCUS_RING"])
+        grown = np.where(labels > 0, labels, dilated.astype(labels.dtype))
+
+    # Only the pixels near particles matter, which skips most of the background
+    pixels = np.flatnonzero(grown)
+    grown = grown.ravel()[pixels]
+    num_pixels = np.maximum(np.bincount(grown, minlength = num_labels), 1)
+
+    sobel = sobel_img.ravel()[pixels]
+    sobel_max = np.zeros(num_labels, dtype = sobel.dtype)
+    np.maximum.at(sobel_max, grown, sobel)
+    mean_gradient = np.bincount(grown, sobel, num_labels) / num_pixels
+
+    laplacian = laplacian_img.ravel()[pixels].astype(np.float64)
+    laplacian_mean = np.bincount(grown, laplacian, num_labels) / num_pixels
+    laplacian_square_mean = np.bincount(grown, laplacian * laplacian, num_labels) / num_pixels
+    laplacian_var = np.maximum(laplacian_square_mean - laplacian_mean * laplacian_mean, 0)
+
+    return {"Sobel_Max": sobel_max.astype(np.float64), "Mean_Gradient": mean_gradient,
+            "Laplacian_Var": laplacian_var}
+
+
+# Determines which particles are acceptable for calculation based on their
+# pixel areas and bounding rectangles, which are arrays holding every particle.
+# Conditions include being within the area limits and not too close to the edge.
+# Returns a boolean array of which particles to keep.
+def acceptable_particles(num_white_pixels, bound_rects, xMax, yMax, config):
+    x, y, width, height = bound_rects.T
+    good_area = ((num_white_pixels > config["AREA_THRESHOLD_MIN"]) &
+                 (num_white_pixels < config["AREA_THRESHOLD_MAX"]))
+    good_position = (x > 1) & (y > 1) & (x + width <= xMax) & (y + height <= yMax)
+
+    return good_area & good_position
+
+
+# Calculate the diameters, axes, eccentricities, aspect ratios and height-dependent
+# measures of every particle at once. data is the structured array of a
+# ParticleTable with its areas filled in and rect_sizes holds the (width, height)
+# of each particle's minimum area rectangle. The tables of a whole batch of
+# images can be joined with np.concatenate and measured in one go as well.
+def calc_geometry(data, rect_sizes, config):
+    calc_diameters(data, config)
 
+    # Find the length of the major and minor axis, the aspect ratios, as well as eccentricity,
+    # or how circular the ellipse is (keep in mind, this is merely a cross-section). The closer
+    # to 0, the more circular.
+    find_side_related_measures(data, rect_sizes)
 
-# Determines whether the corresponding particle is acceptable for calculation.
-# Conditions include not too close to the edge and not too transparent for
-# accuracy.
-def acceptable_particle(num_white_pixels, bound_rect, xMax, yMax, maxval):
-    (x, y, width, height) = bound_rect
-    if (maxval > CLARITY_THRESHOLD and num_white_pixels > AREA_THRESHOLD_MIN and
-        num_white_pixels < AREA_THRESHOLD_MAX):
-        if (x > 1 and y > 1 and (x + width <= xMax and y + height <= yMax)):
-            return True
-        else:
-            return False
-    else:
-        return False
+    # Find the surface areas, volumes, and sauter diameters if the user provides
+    # an estimate for the average height of all the particles
+    find_height_dependent_measures(data, config)
 
 
 # Calculate diameters using the auto generated areas and pixel-counted areas
-def calc_diameters():
-    for i in range(len(auto_areas)):
-        auto_diameter = PROJECTED_PIXEL_SIZE * (math.sqrt(4 * auto_areas[i] / math.pi));
-        pixel_diameter = PROJECTED_PIXEL_SIZE * (math.sqrt(4 * pixel_areas[i] / math.pi))
-        auto_diameters.append(auto_diameter)
-        pixel_diameters.append(pixel_diameter)
+def calc_diameters(data, config):
+    data["Contour_Diameter"] = config["PROJECTED_PIXEL_SIZE"] * np.sqrt(4 * data["Contour_Area"] / math.pi)
+    data["Pixel_Diameter"] = config["PROJECTED_PIXEL_SIZE"] * np.sqrt(4 * data["Pixel_Area"] / math.pi)
 
 
 # Save the major and minor axes properly, then derive the eccentricity as well as
 # aspect ratio from them
-def find_side_related_measures():
-    for min_area_rect in filtered_min_area_rects:
-        center, size, angle = min_area_rect
-        x, y = center
-        side1, side2 = size
-        minor_axis = side1
-        major_axis = side2
-        if major_axis < minor_axis:
-            minor_axis = side2
-            major_axis = side1
-        major_axes.append(major_axis)
-        minor_axes.append(minor_axis)
-
-        # Derive the eccentricity
-        find_cross_section_eccentricity(minor_axis, major_axis)
-
-        # Derive the aspect aspect ratio
-        find_aspect_ratio(minor_axis, major_axis)
+def find_side_related_measures(data, rect_sizes):
+    major_axis = rect_sizes.max(axis = 1)
+    minor_axis = rect_sizes.min(axis = 1)
+    data["Major_axis"] = major_axis
+    data["Minor_axis"] = minor_axis
+
+    # Derive the eccentricity
+    data["Eccentricity"] = find_cross_section_eccentricity(minor_axis, major_axis)
+
+    # Derive the aspect aspect ratio
+    data["Aspect_Ratio"] = find_aspect_ratio(minor_axis, major_axis)
 
 
 # Calculate the eccentricities, or how circular the ellipses contained in the
 # minimum area rectangles are.
 def find_cross_section_eccentricity(minor_axis, major_axis):
-    squared_e = 1 - (math.pow(minor_axis, 2) / math.pow(major_axis, 2))
-    e = math.sqrt(squared_e)
-    eccentricities.append(e)
+    squared_e = 1 - (np.power(minor_axis, 2) / np.power(major_axis, 2))
+    e = np.sqrt(squared_e)
+
+    return e
 
 
 # Calculate the aspect ratio, or the ratio of the minor_axis to the major_axis
 def find_aspect_ratio(minor_axis, major_axis):
     ratio = minor_axis / major_axis
-    aspect_ratios.append(ratio)
+
+    return ratio
 
 
 # Set particle height for further measurements if the user defines a value at
@@ -372,36 +1092,31 @@ def estimate_height(major_axis, minor_axis):
 # Depending on user input, calculate the surface area, volume, and sauter diameter
 # of all particles assuming they have a similar average height and are shaped like
 # ellipsoids
-def find_height_dependent_measures():
-    # Set c in whatever the user input
-    if AVG_PARTICLE_HEIGHT != -1:
-        c = AVG_PARTICLE_HEIGHT / 2
-    current_surface_area = 0
-
-    # Iterate through all min area rects to calculate height-dependent measures
-    for i in range(len(filtered_min_area_rects)):
-        center, size, angle = filtered_min_area_rects[i]
-        major_axis, minor_axis = size
-        a = major_axis / 2
-        b = minor_axis / 2
-
-        # Height wasn't set by user, so set c based on an estimate
-        if AVG_PARTICLE_HEIGHT == -1:
-            c = estimate_height(major_axis, minor_axis) / 2
-
-        # Calculate heigh-dependent measurements now!
-        current_surface_area = calc_ellipsoid_surface_area(a, b, c)
-        current_volume = calc_ellipsoid_volume(a, b, c)
-        calc_sauter_diameter(current_surface_area)
+def find_height_dependent_measures(data, config):
+    major_axis = data["Major_axis"]
+    minor_axis = data["Minor_axis"]
+    a = major_axis / 2
+    b = minor_axis / 2
+
+    # Set c in whatever the user input, otherwise set c based on an estimate
+    if config["AVG_PARTICLE_HEIGHT"] != -1:
+        c = config["AVG_PARTICLE_HEIGHT"] / 2
+    else:
+        c = estimate_height(major_axis, minor_axis) / 2
 
-        calc_sphericity(current_surface_area, current_volume)
+    # Calculate heigh-dependent measurements now!
+    surface_area = calc_ellipsoid_surface_area(a, b, c)
+    volume = calc_ellipsoid_volume(a, b, c)
+    data["Surface_Area"] = surface_area
+    data["Volume"] = volume
+    data["Sauter_Diameter"] = calc_sauter_diameter(surface_area)
+    data["Sphericity"] = calc_sphericity(surface_area, volume)
 
 
 # Surface Area calculation
 def calc_ellipsoid_surface_area(a, b, c):
-    numerator = math.pow(a * b, 1.6) + math.pow(a * c, 1.6) + math.pow(b * c, 1.6)
-    surface_area = 4 * math.pi * math.pow(numerator / 3, 1/1.6)
-    surface_areas.append(surface_area)
+    numerator = np.power(a * b, 1.6) + np.power(a * c, 1.6) + np.power(b * c, 1.6)
+    surface_area = 4 * math.pi * np.power(numerator / 3, 1/1.6)
 
     return surface_area
 
@@ -409,182 +1124,107 @@ def calc_ellipsoid_surface_area(a, b, c):
 # Volume calculation
 def calc_ellipsoid_volume(a, b, c):
     volume = (4 / 3) * math.pi * a * b * c
-    volumes.append(volume)
 
     return volume
 
 
 # If surface areas and volumes were calculated (as in the user gave a potential
 # height input), then move on to find sauter diameters.
-def calc_sauter_diameter(current_surface_area):
-    surface_diameter = math.sqrt(current_surface_area / math.pi)
-    sauter_diameters.append(surface_diameter)
+def calc_sauter_diameter(surface_area):
+    surface_diameter = np.sqrt(surface_area / math.pi)
+
+    return surface_diameter
 
 
 # Calculate sphericity only if height has been provided and surface area/volume
 # has also been estimated
-def calc_sphericity(current_surface_area, current_volume):
-    radius_for_volume = math.pow(current_volume * (3/4) / math.pi, 1/3)
-    sphere_surface_area = 4 * math.pi * math.pow(radius_for_volume, 2)
-    sphericity = sphere_surface_area / current_surface_area
-    sphericities.append(sphericity)
-
-
-# Clean up lists for the next image to populate
-def clear_lists():
-    filtered_min_area_rects.clear()
-    auto_areas.clear()
-    pixel_areas.clear()
-    auto_diameters.clear()
-    pixel_diameters.clear()
-    eccentricities.clear()
-    aspect_ratios.clear()
-    minor_axes.clear()
-    major_axes.clear()
-
-    # clear height-dependent lists
-    if (AVG_PARTICLE_HEIGHT != -1):
-        surface_areas.clear()
-        sauter_diameters.clear()
-        volumes.clear()
-        sphericities.clear()
-
-
-# Create the excel sheet to be edited. All data will end up in such a file called
-# 'results.xlsx'
-def setup_xl_file():
-    # Create excel file
-    xl_filename = RESULTS_FILENAME
-    workbook = xls.Workbook(xl_filename)
-    xl_sheet_data = workbook.add_worksheet("data")
-    xl_sheet_summary = workbook.add_worksheet("summary")
-    bold = workbook.add_format({'bold': 1})
-    xl_sheet_data.set_column(0, 14, 15)
-    xl_sheet_summary.set_column(0, 1, 25)
-
-    #Write column headers for data
-    xl_sheet_data.write('A1', 'File_Name', bold)
-    xl_sheet_data.write('B1', 'Pixel_Area', bold)
-    xl_sheet_data.write('C1', 'Pixel_Diameter', bold)
-    xl_sheet_data.write('D1', 'Contour_Area', bold)
-    xl_sheet_data.write('E1', 'Contour_Diameter', bold)
-    xl_sheet_data.write('F1', 'Major_axis', bold)
-    xl_sheet_data.write('G1', 'Minor_axis', bold)
-    xl_sheet_data.write('H1', 'Aspect_Ratio', bold)
-    xl_sheet_data.write('I1', 'Eccentricity', bold)
-    xl_sheet_data.write('J1', 'Surface_Area', bold)
-    xl_sheet_data.write('K1', 'Sauter_Diameter', bold)
-    xl_sheet_data.write('L1', 'Volume', bold)
-    xl_sheet_data.write('M1', 'Sphericity', bold)
-    xl_sheet_data.write('N1', 'X_coord', bold)
-    xl_sheet_data.write('O1', 'Y_coord', bold)
-
-    return workbook, xl_sheet_data, xl_sheet_summary
-
-
-# Write out data to the excel file
-def write_data_to_excel(filename, startRow, xl_sheet_data):
-    row = 0
-    for i in range(len(filtered_min_area_rects)):
-        row = startRow + i
-        center, size, angle = filtered_min_area_rects[i]
-        x, y = center
-        xl_sheet_data.write(row, 0, filename)
-        xl_sheet_data.write_number(row, 1, pixel_areas[i])
-        xl_sheet_data.write_number(row, 2, pixel_diameters[i])
-        xl_sheet_data.write_number(row, 3, auto_areas[i])
-        xl_sheet_data.write_number(row, 4, auto_diameters[i])
-        xl_sheet_data.write_number(row, 5, major_axes[i])
-        xl_sheet_data.write_number(row, 6, minor_axes[i])
-        xl_sheet_data.write_number(row, 7, aspect_ratios[i])
-        xl_sheet_data.write_number(row, 8, eccentricities[i])
-
-        # Write height-dependent calculations out, depending on user input
-        xl_sheet_data.write_number(row, 9, surface_areas[i])
-        xl_sheet_data.write(row, 10, sauter_diameters[i])
-        xl_sheet_data.write_number(row, 11, volumes[i])
-        xl_sheet_data.write_number(row, 12, sphericities[i])
-
-        xl_sheet_data.write_number(row, 13, x)
-        xl_sheet_data.write_number(row, 14, y)
-
-
-    return row
-
-
-# Write the average functions for the excel sheet to see the overall area and
-# diameter averages
-def write_xl_summaries(numData, workbook, xl_sheet1, xl_sheet_summary):
-    numData = str(numData)
-    # Write summary section headers
-    bold = workbook.add_format({'bold': 1})
-    xl_sheet_summary.write('A1', 'SUMMARY', bold)
-    xl_sheet_summary.write('A2', 'AVG_PIXEL_AREA:', bold)
-    xl_sheet_summary.write('A3', 'AVG_PIXEL_DIAMETER:', bold)
-    xl_sheet_summary.write('A4', 'AVG_CONTOUR_AREA:', bold)
-    xl_sheet_summary.write('A5', 'AVG_CONTOUR_DIAMETER:', bold)
-    xl_sheet_summary.write('A6', 'AVG_MINOR_AXIS:', bold)
-    xl_sheet_summary.write('A7', 'AVG_MAJOR_AXIS:', bold)
-    xl_sheet_summary.write('A8', 'AVG_ASPECT_RATIO:', bold)
-    xl_sheet_summary.write('A9', 'AVG_ECCENTRICITY:', bold)
-    xl_sheet_summary.write('A10', 'MAX_ECCENTRICITY:', bold)
-    xl_sheet_summary.write('A11', 'MIN_PIXEL_AREA:', bold)
-    xl_sheet_summary.write('A12', 'MAX_PIXEL_AREA:', bold)
-    xl_sheet_summary.write('A13', 'SAUTER_MEAN_DIAMETER:', bold)
-    xl_sheet_summary.write('A14', 'AVG_VOLUME:', bold)
-    xl_sheet_summary.write('A15', 'AVG_SPHERICITY:', bold)
-    xl_sheet_summary.write('A16', 'AVG_SURFACE_AREA:', bold)
-
-
-
-    # Write actual summary functions
-    xl_sheet_summary.write(1, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!B2:" + xl_sheet1.get_name() + "!B" + numData + ")")
-    xl_sheet_summary.write(2, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!C2:" + xl_sheet1.get_name() + "!C" + numData + ")")
-    xl_sheet_summary.write(3, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!D2:" + xl_sheet1.get_name() + "!D" + numData + ")")
-    xl_sheet_summary.write(4, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!E2:" + xl_sheet1.get_name() + "!E" + numData + ")")
-    xl_sheet_summary.write(5, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!F2:" + xl_sheet1.get_name() + "!F" + numData + ")")
-    xl_sheet_summary.write(6, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!G2:" + xl_sheet1.get_name() + "!G" + numData + ")")
-    xl_sheet_summary.write(7, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!H2:" + xl_sheet1.get_name() + "!H" + numData + ")")
-    xl_sheet_summary.write(8, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!I2:" + xl_sheet1.get_name() + "!I" + numData + ")")
-    xl_sheet_summary.write(9, 1, "=MAX(" + xl_sheet1.get_name() + "!I2:" + xl_sheet1.get_name() + "!I" + numData + ")")
-    xl_sheet_summary.write(10, 1, "=MIN(" + xl_sheet1.get_name() + "!B2:" + xl_sheet1.get_name() + "!B" + numData + ")")
-    xl_sheet_summary.write(11, 1, "=MAX(" + xl_sheet1.get_name() + "!B2:" + xl_sheet1.get_name() + "!B" + numData + ")")
-    xl_sheet_summary.write(12, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!K2:" + xl_sheet1.get_name() + "!K" + numData + ")")
-    xl_sheet_summary.write(13, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!L2:" + xl_sheet1.get_name() + "!L" + numData + ")")
-    xl_sheet_summary.write(14, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!M2:" + xl_sheet1.get_name() + "!M" + numData + ")")
-    xl_sheet_summary.write(15, 1, "=AVERAGE(" + xl_sheet1.get_name() + "!J2:" + xl_sheet1.get_name() + "!J" + numData + ")")
-
-
-# For testing purposes. Draws the bounding rectangles around the particles that
-# were analysed and writes this out to an image file called "rect_threshold_image"
-def draw_rect_img(thresh_rgb_img, img, contours, file_name):
-    for i in range(len(filtered_min_area_rects)):
-        # Draw rotated best-fit rectangles
-        rotated_rect = cv2.boxPoints(filtered_min_area_rects[i])
-        rotated_rect = np.int0(rotated_rect)
-        cv2.drawContours(thresh_rgb_img, [rotated_rect], -1, (0,255,0), 2)
-        cv2.drawContours(img, [rotated_rect], -1, (0,0,255), 2)
-        cv2.drawContours(img, contours, -1, (0,0,255), 3)
-
-    cv2.imwrite(str(pathlib.Path(TEST_RESULTS_PATH + "/" + file_name + "_5_rect_thresh_image.bmp")), thresh_rgb_img)
-    cv2.imwrite(str(pathlib.Path(TEST_RESULTS_PATH + "/" + file_name + "_6_rect_og_image.bmp")), img)
-
-
-# For testing purposes, save all cropped threshold images that contain reasonable particles into a folder
-# called "crops"
-def save_thresh_roi_crops():
-    if TEST:
-        for i in range(len(crops)):
-            cv2.imwrite(str(pathlib.Path(TEST_RESULTS_PATH + "/crops/crop" + str(i) + ".bmp")), crops[i])
+def calc_sphericity(surface_area, volume):
+    radius_for_volume = np.power(volume * (3/4) / math.pi, 1/3)
+    sphere_surface_area = 4 * math.pi * np.power(radius_for_volume, 2)
+    sphericity = sphere_surface_area / surface_area
+
+    return sphericity
+
+
+# For testing purposes. Draws the rotated best-fit rectangles around the
+# particles that were analysed onto the threshold image ("5_rect_thresh_image"),
+# and along with the contours onto the original image ("6_rect_og_image"). Only
+# the images in DEBUG_STAGES are drawn.
+def draw_rect_img(thresh_img, img, contours, file_name, table, config):
+    if "5_rect_thresh_image" in config["DEBUG_STAGES"]:
+        write_debug_img(file_name, "5_rect_thresh_image", overlayRenderer.draw_overlay(
+            thresh_img, table.rects, overlayRenderer.GREEN, scale = config["OVERLAY_SCALE"]), config)
+    if "6_rect_og_image" in config["DEBUG_STAGES"]:
+        write_debug_img(file_name, "6_rect_og_image", overlayRenderer.draw_overlay(
+            img, table.rects, overlayRenderer.RED, contours, config["OVERLAY_SCALE"]), config)
+
+
+# For testing purposes, the cropped threshold images of every particle that is
+# measured are saved into a crop archive called "crops" in TEST_RESULTS_PATH
+def saving_crops(config):
+    return config["TEST"] and "crops" in config["DEBUG_STAGES"]
 
 
 # For the purpose of seeing what is happening to the images at each step.
 # If TEST = True, writes out the image files into a folder designated by
 # TEST_RESULTS_PATH
-def test_img(name, img):
-    if TEST:
-        file_path = str(pathlib.Path(TEST_RESULTS_PATH + "/" + name + ".bmp"))
-        cv2.imwrite(file_path, img)
+def test_img(file_name, stage, img, config):
+    if config["TEST"]:
+        with runMetrics.stage("debug_images"):
+            write_debug_img(file_name, stage, img, config)
+
+
+# Write out the debug image of a step of the analysis as <file_name>_<stage>,
+# if that step is one of DEBUG_STAGES
+def write_debug_img(file_name, stage, img, config):
+    if stage in config["DEBUG_STAGES"]:
+        path = pathlib.Path(config["TEST_RESULTS_PATH"] + "/" + file_name + "_" + stage + ".bmp")
+        get_image_writer(config).write(path, img)
+
+
+# The background writer for the debug images of config, started on first use.
+# Configs with different DEBUG_ settings get writers of their own. Worker
+# processes never get back to main(), so their writers are flushed when the
+# process exits instead.
+def get_image_writer(config):
+    key = (config["DEBUG_QUEUE_SIZE"], config["DEBUG_DROP_WHEN_FULL"], config["DEBUG_IMAGE_FORMAT"],
+           config["DEBUG_PNG_COMPRESSION"], config["DEBUG_JPEG_QUALITY"])
+    with image_writer_lock:
+        if key not in image_writers:
+            if not image_writers and multiprocessing.current_process().name != "MainProcess":
+                multiprocessing.util.Finalize(None, close_image_writer, exitpriority = 10)
+            image_writers[key] = ImageWriter(key[0], not key[1], key[2], key[3], key[4])
+
+        return image_writers[key]
+
+
+# Wait for every debug image to be written out, then report how many were
+# written, deferred or dropped
+def close_image_writer():
+    with image_writer_lock:
+        writers = list(image_writers.values())
+        image_writers.clear()
+    for writer in writers:
+        writer.close()
+        print(multiprocessing.current_process().name + " " + writer.stats())
+
+
+# The result cache, opened on first use, or None if RESULT_CACHE_PATH is not set
+def get_result_cache():
+    global result_cache
+    if RESULT_CACHE_PATH and result_cache is None:
+        result_cache = ResultCache(RESULT_CACHE_PATH, RESULT_CACHE_MAX_MB * 1024 * 1024)
+
+    return result_cache
+
+
+# The detection settings an image is cached under, along with the OpenCV version
+# since the contours it finds can change between versions
+def cache_settings():
+    settings = {name: globals()[name] for name in CACHE_KEY_SETTINGS}
+    settings["opencv_version"] = cv2.__version__
+
+    return settings
 
 
 # Run the main program
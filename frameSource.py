@@ -0,0 +1,156 @@
+# Python 3.6.5 script for reading the frames to be analysed
+# Specifically reads single image files, raw frame stacks dumped by the camera and
+# multi-page TIFF files. Raw stacks are memory-mapped, so their frames are handed
+# out as views of the file without being copied or decoded.
+
+# Imports:
+import collections
+import concurrent.futures
+import itertools
+import json
+import os
+import pathlib
+import cv2
+import numpy as np
+
+
+# File types analysed as a single frame, as a raw frame stack or as a
+# multi-page TIFF file
+IMAGE_EXTENSIONS = (".bmp",)
+STACK_EXTENSIONS = (".raw",)
+TIFF_EXTENSIONS = (".tif", ".tiff")
+
+# Raw stacks opened by this process, by path, so each is only mapped once
+open_stacks = {}
+
+
+# A raw stack of frames stored one after another, optionally after a header,
+# described by a JSON sidecar file with the same name as the stack (stack.json
+# for stack.raw). The sidecar holds:
+#   "width", "height"  - size of every frame in pixels
+#   "dtype"            - numpy type of a pixel value, e.g. "uint8" or "uint16"
+#   "channels"         - 1 for grayscale frames (the default) or 3 for BGR
+#   "header_bytes"     - bytes to skip at the start of the file (default 0)
+#   "frames"           - number of frames (default: as many as fit in the file)
+#   "bit_depth"        - bits actually used per value, e.g. 12 for a 12-bit
+#                        camera saving uint16 values (default: all of them)
+class RawStack:
+    def __init__(self, path):
+        with open(str(pathlib.Path(path).with_suffix(".json"))) as file:
+            settings = json.load(file)
+
+        dtype = np.dtype(settings["dtype"])
+        if dtype.kind != "u":
+            raise ValueError("Raw stacks must hold unsigned integers: " + str(path))
+        channels = settings.get("channels", 1)
+        header_bytes = settings.get("header_bytes", 0)
+        frame_shape = (settings["height"], settings["width"])
+        if channels != 1:
+            frame_shape = frame_shape + (channels,)
+
+        frame_bytes = int(np.prod(frame_shape)) * dtype.itemsize
+        num_frames = settings.get("frames", (os.path.getsize(str(path)) - header_bytes) // frame_bytes)
+        self.frames = np.memmap(str(path), dtype = dtype, mode = "r", offset = header_bytes,
+                                shape = (num_frames,) + frame_shape)
+        self.bit_depth = settings.get("bit_depth", dtype.itemsize * 8)
+
+    def __len__(self):
+        return len(self.frames)
+
+    # A frame of the stack. 8-bit frames are read-only views of the file, while
+    # deeper frames are scaled down to 8 bits, which makes a copy.
+    def frame(self, index):
+        frame = self.frames[index]
+        if frame.dtype != np.uint8:
+            frame = np.right_shift(frame, max(self.bit_depth - 8, 0)).astype(np.uint8)
+
+        return frame
+
+
+# Open the raw stack at path, reusing it if this process has already opened it
+def open_stack(path):
+    path = str(path)
+    if path not in open_stacks:
+        open_stacks[path] = RawStack(path)
+
+    return open_stacks[path]
+
+
+# Find every frame in folder, in file name order. Returns a list of
+# (file_name, frame_index) pairs, where frame_index is None for single images.
+def find_frames(folder):
+    frames = []
+    for file_name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, file_name)
+        extension = os.path.splitext(file_name)[1].lower()
+        if os.path.isdir(path):
+            continue
+
+        if extension in IMAGE_EXTENSIONS:
+            frames.append((file_name, None))
+        elif extension in STACK_EXTENSIONS:
+            frames.extend((file_name, i) for i in range(len(open_stack(path))))
+        elif extension in TIFF_EXTENSIONS:
+            frames.extend((file_name, i) for i in range(cv2.imcount(path)))
+
+    return frames
+
+
+# Read a frame found by find_frames. Single images are read in colour as before,
+# raw stack frames come straight from the memory map and TIFF pages are read one
+# at a time, as 8-bit grayscale or colour. A single image already read into
+# memory by read_encoded_frame can be handed over as encoded, to be decoded here.
+def read_frame(folder, file_name, frame_index, encoded = None):
+    path = os.path.join(folder, file_name)
+    if encoded is not None:
+        return cv2.imdecode(np.frombuffer(encoded, dtype = np.uint8), cv2.IMREAD_COLOR)
+    if frame_index is None:
+        return cv2.imread(path)
+
+    if os.path.splitext(file_name)[1].lower() in STACK_EXTENSIONS:
+        return open_stack(path).frame(frame_index)
+
+    ok, pages = cv2.imreadmulti(path, frame_index, 1, flags = cv2.IMREAD_ANYCOLOR)
+    if not ok:
+        raise IOError("Could not read page " + str(frame_index) + " of " + path)
+
+    return pages[0]
+
+
+# Read the file of a single image into memory without decoding it, so the slow
+# part of reading it from a disk or network share can be done ahead of time and
+# the decoding left to whichever process analyses it. Returns None for frames of
+# stacks, which are cheaper to map or read where they are analysed.
+def read_encoded_frame(folder, file_name, frame_index):
+    if frame_index is not None:
+        return None
+
+    with open(os.path.join(folder, file_name), "rb") as file:
+        return file.read()
+
+
+# Start reading frames on a pool of threads, up to look_ahead frames ahead of the
+# one being used, so reading the next frames overlaps with analysing this one.
+# Yields (frame, future) pairs in the order of frames, where future holds the
+# result of read(frame). At most look_ahead frames are read but not yet used,
+# which caps the memory they take up. A look_ahead of 0 reads nothing ahead.
+def prefetch_frames(frames, read, look_ahead = 2, threads = 2):
+    frames = iter(frames)
+    with concurrent.futures.ThreadPoolExecutor(max(threads, 1)) as executor:
+        pending = collections.deque((frame, executor.submit(read, frame))
+                                    for frame in itertools.islice(frames, look_ahead))
+        for frame in frames:
+            pending.append((frame, executor.submit(read, frame)))
+            yield pending.popleft()
+        while pending:
+            yield pending.popleft()
+
+
+# The name a frame's results are saved under: the file name without its
+# extension, followed by the frame number for frames of a stack
+def frame_name(file_name, frame_index):
+    name = os.path.splitext(file_name)[0]
+    if frame_index is None:
+        return name
+
+    return name + "_" + str(frame_index).zfill(5)
@@ -0,0 +1,204 @@
+# Python 3.6.5 script for running FSI-Python from the command line
+# Specifically a single entry point with a subcommand for each script, taking the
+# settings as arguments instead of edited globals. Each subcommand only imports
+# what it needs, so cleaning or exporting results never loads OpenCV.
+
+# Imports:
+import argparse
+import importlib
+import json
+import pathlib
+import sys
+import time
+
+
+# Large modules that --import-times reports on, to show which ones a command loaded
+HEAVY_MODULES = ["cv2", "numpy", "pandas", "openpyxl", "xlsxwriter"]
+
+
+def main(argv = None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return 2
+
+    # Import the modules of the subcommand, timing each one
+    modules = []
+    import_times = []
+    for name in args.modules:
+        start = time.perf_counter()
+        modules.append(importlib.import_module(name))
+        import_times.append((name, time.perf_counter() - start))
+    if args.import_times:
+        print_import_report(import_times)
+
+    if args.setup is not None:
+        args.setup(args, *modules)
+    try:
+        apply_settings(modules[0], args.set, args.arguments)
+    except ValueError as error:
+        parser.error(str(error))
+
+    return args.run(args, *modules)
+
+
+# The parser of the command line arguments, with a subparser for every command
+def make_parser():
+    parser = argparse.ArgumentParser(prog = "fsi.py", description = "Particle size analysis for the FSI flowcell.")
+    parser.add_argument("--import-times", action = "store_true",
+                        help = "report how long the modules of the command took to import and which large modules were loaded")
+    commands = parser.add_subparsers(dest = "command")
+
+    analyse = commands.add_parser("analyse", help = "analyse a folder of images (determineParticleSizes.py)")
+    analyse.add_argument("folder", help = "folder of the images to analyse")
+    analyse.add_argument("--results", help = "results file, .xlsx, .csv or .sqlite (default: img_results/results_test.xlsx in the folder)")
+    analyse.add_argument("--test-results", help = "folder for the debug images (default: img_results in the folder)")
+    threshold = analyse.add_mutually_exclusive_group()
+    threshold.add_argument("--threshold", type = int, help = "custom threshold value (THRESH_PARAM)")
+    threshold.add_argument("--otsu", action = "store_true", help = "use the threshold the Otsu algorithm picks")
+    height = analyse.add_mutually_exclusive_group()
+    height.add_argument("--height", type = float, help = "average particle height (AVG_PARTICLE_HEIGHT)")
+    height.add_argument("--ask-height", action = "store_true", help = "ask for the average particle height as before")
+    analyse.add_argument("--workers", type = int, help = "number of worker processes, 0 for every core (NUM_WORKERS)")
+    analyse.add_argument("--watch", action = "store_true", help = "keep analysing new images as they arrive (WATCH_FOLDER)")
+    analyse.add_argument("--no-debug", action = "store_true", help = "do not write any debug images (TEST and DEBUG_STAGES, which --set can still change)")
+    analyse.set_defaults(run = run_analyse, setup = setup_analyse, modules = ["determineParticleSizes"],
+                         arguments = {"IMAGE_FOLDER_PATH": "folder", "TEST_RESULTS_PATH": "--test-results",
+                                      "RESULTS_FILENAME": "--results", "CUSTOM_THRESH": "--threshold or --otsu",
+                                      "THRESH_PARAM": "--threshold", "AVG_PARTICLE_HEIGHT": "--height",
+                                      "NUM_WORKERS": "--workers", "WATCH_FOLDER": "--watch"})
+
+    dedupe = commands.add_parser("dedupe", help = "filter repeated particles out of results (repeatParticleRemoval.py)")
+    dedupe.add_argument("original", help = "results file to filter, .xlsx, .csv or .sqlite")
+    dedupe.add_argument("new", help = "file to write the filtered results to, .xlsx, .csv or .sqlite")
+    dedupe.add_argument("--position-range", type = float, help = "POSITIONAL_REMOVAL_RANGE")
+    dedupe.add_argument("--area-range", type = float, help = "AREA_REMOVAL_RANGE")
+    dedupe.add_argument("--max-percent", type = float, help = "MAX_PERCENT_REMOVED")
+    dedupe.set_defaults(run = run_dedupe, setup = None, modules = ["repeatParticleRemoval"],
+                        arguments = {"ORIGINAL_XL_FILENAME": "original", "NEW_XL_FILENAME": "new",
+                                     "POSITIONAL_REMOVAL_RANGE": "--position-range",
+                                     "AREA_REMOVAL_RANGE": "--area-range", "MAX_PERCENT_REMOVED": "--max-percent"})
+
+    export = commands.add_parser("export", help = "write an Excel workbook with the summary sheet from .csv or .sqlite results")
+    export.add_argument("results", help = "results file to export")
+    export.add_argument("workbook", nargs = "?", help = "Excel file to write (default: the results file name with .xlsx)")
+    export.add_argument("--no-formulas", action = "store_true", help = "only write the summary values, not the Excel functions")
+    export.set_defaults(run = run_export, setup = None, modules = ["resultStore"], arguments = {})
+
+    test = commands.add_parser("test", help = "run the test sets (testing.py), from the folder holding TestSets")
+    test.set_defaults(run = run_test, setup = None, modules = ["testing", "determineParticleSizes"], arguments = {})
+
+    bench = commands.add_parser("bench", help = "benchmark the analysis on synthetic images (benchmark.py)")
+    bench.add_argument("--results", help = "JSON file to write the timings to (BENCHMARK_RESULTS)")
+    bench.add_argument("--repeats", type = int, help = "number of times each image is analysed (REPEATS)")
+    bench.set_defaults(run = run_bench, setup = None, modules = ["benchmark", "determineParticleSizes"],
+                       arguments = {"BENCHMARK_RESULTS": "--results", "REPEATS": "--repeats"})
+
+    # Every command can change any other setting of the script it runs. Settings
+    # with an argument of their own (the arguments default above) are set by the
+    # command itself, so they have to be changed with that argument instead.
+    # The setup of a command runs before --set, so --set can still change what
+    # setup changed.
+    for command in [analyse, dedupe, export, test, bench]:
+        command.add_argument("--set", action = "append", default = [], metavar = "NAME=VALUE",
+                             help = "change any other setting at the top of the script, e.g. --set DENOISE_METHOD=median "
+                                    "(the value is read as JSON if it can be)")
+
+    return parser
+
+
+# Settings of analyse that --set may change again, e.g. --no-debug with
+# --set DEBUG_STAGES='["crops"]' to only save the crops
+def setup_analyse(args, dps):
+    if args.no_debug:
+        dps.TEST = False
+        dps.DEBUG_STAGES = []
+
+
+def run_analyse(args, dps):
+    folder = pathlib.Path(args.folder)
+    dps.IMAGE_FOLDER_PATH = str(folder)
+    dps.TEST_RESULTS_PATH = args.test_results or str(folder / "img_results")
+    dps.RESULTS_FILENAME = args.results or str(pathlib.Path(dps.TEST_RESULTS_PATH) / "results_test.xlsx")
+    if args.threshold is not None:
+        dps.CUSTOM_THRESH = True
+        dps.THRESH_PARAM = args.threshold
+    if args.otsu:
+        dps.CUSTOM_THRESH = False
+    if args.height is not None:
+        dps.AVG_PARTICLE_HEIGHT = args.height
+    if args.workers is not None:
+        dps.NUM_WORKERS = args.workers
+    if args.watch:
+        dps.WATCH_FOLDER = True
+
+    dps.main(ask_height = args.ask_height)
+    return 0
+
+
+def run_dedupe(args, rpr):
+    rpr.ORIGINAL_XL_FILENAME = args.original
+    rpr.NEW_XL_FILENAME = args.new
+    if args.position_range is not None:
+        rpr.POSITIONAL_REMOVAL_RANGE = args.position_range
+    if args.area_range is not None:
+        rpr.AREA_REMOVAL_RANGE = args.area_range
+    if args.max_percent is not None:
+        rpr.MAX_PERCENT_REMOVED = args.max_percent
+
+    rpr.main()
+    return 0
+
+
+def run_export(args, result_store):
+    workbook = args.workbook or str(pathlib.Path(args.results).with_suffix(".xlsx"))
+    result_store.export_excel(args.results, workbook, not args.no_formulas)
+    print("Results exported to " + workbook)
+    return 0
+
+
+def run_test(args, testing, dps):
+    testing.main()
+    return 0 if testing.NUM_FAIL == 0 else 1
+
+
+def run_bench(args, benchmark, dps):
+    if args.results is not None:
+        benchmark.BENCHMARK_RESULTS = args.results
+    if args.repeats is not None:
+        benchmark.REPEATS = args.repeats
+
+    benchmark.main()
+    return 0
+
+
+# Change settings of a script module given as NAME=VALUE strings. Values are
+# read as JSON where they can be, so numbers, true/false and lists work, and
+# are taken as strings otherwise. Settings named in arguments are turned down
+# with the argument to use instead, as the command would overwrite them.
+def apply_settings(module, settings, arguments):
+    for setting in settings:
+        name, separator, value = setting.partition("=")
+        if not separator or not name.isupper() or not hasattr(module, name):
+            raise ValueError("Unknown setting of " + module.__name__ + ": " + setting)
+        if name in arguments:
+            raise ValueError(name + " has an argument of its own, use " + arguments[name] + " instead of --set")
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+        setattr(module, name, value)
+
+
+# Print how long each module took to import and which large modules are loaded
+def print_import_report(import_times):
+    for name, seconds in import_times:
+        print("Imported " + name + " in " + str(round(seconds * 1000, 1)) + " ms")
+    print("Large modules loaded: " + (", ".join(name for name in HEAVY_MODULES if name in sys.modules) or "none"))
+    print("Large modules not loaded: " + (", ".join(name for name in HEAVY_MODULES if name not in sys.modules) or "none"))
+
+
+# Run the main program
+if __name__ == "__main__":
+    sys.exit(main())
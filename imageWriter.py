@@ -0,0 +1,88 @@
+# Python 3.6.5 script for writing image files out in the background
+# Specifically a writer thread fed through a bounded queue, so the analysis
+# never has to wait on a slow disk or network share to save its debug images.
+
+# Imports:
+import pathlib
+import queue
+import threading
+import cv2
+
+
+# Writes images handed to it on a background thread, in the order they were
+# handed over. At most max_queued images wait to be written at a time. When the
+# queue is full, write() either waits for room (block = True, counted as a
+# deferred write) or skips the image (block = False, counted as a dropped write).
+# Every image is saved in image_format (".bmp", ".png" or ".jpg") whatever
+# extension its path has, with the given PNG compression level (0-9) or JPEG
+# quality (0-100).
+class ImageWriter:
+    def __init__(self, max_queued = 16, block = True, image_format = ".bmp",
+                 png_compression = 3, jpeg_quality = 95):
+        self.queue = queue.Queue(max_queued)
+        self.block = block
+        self.image_format = image_format.lower()
+        if self.image_format == ".png":
+            self.params = [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+        elif self.image_format in (".jpg", ".jpeg"):
+            self.params = [cv2.IMWRITE_JPEG_QUALITY, jpeg_quality]
+        elif self.image_format == ".bmp":
+            self.params = []
+        else:
+            raise ValueError("Unknown image format: " + image_format)
+
+        self.num_written = 0
+        self.num_deferred = 0
+        self.num_dropped = 0
+        self.num_failed = 0
+        # Images are handed over from several threads at once, such as tiles
+        self.count_lock = threading.Lock()
+
+        self.thread = threading.Thread(target = self.run, daemon = True)
+        self.thread.start()
+
+    # Queue an image to be written to path. The image is copied first, so the
+    # caller is free to keep drawing on it. Returns False if it was dropped.
+    def write(self, path, img):
+        entry = (str(pathlib.Path(path).with_suffix(self.image_format)), img.copy())
+        try:
+            self.queue.put_nowait(entry)
+        except queue.Full:
+            if not self.block:
+                with self.count_lock:
+                    self.num_dropped = self.num_dropped + 1
+                return False
+            with self.count_lock:
+                self.num_deferred = self.num_deferred + 1
+            self.queue.put(entry)
+
+        return True
+
+    # Write out queued images until close() is called
+    def run(self):
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                break
+
+            path, img = entry
+            try:
+                written = cv2.imwrite(path, img, self.params)
+            except cv2.error:
+                written = False
+
+            if written:
+                self.num_written = self.num_written + 1
+            else:
+                self.num_failed = self.num_failed + 1
+
+    # Wait for every queued image to be written and stop the writer thread
+    def close(self):
+        if self.thread.is_alive():
+            self.queue.put(None)
+            self.thread.join()
+
+    # A line describing how many images were written, deferred, dropped and failed
+    def stats(self):
+        return ("Debug images: " + str(self.num_written) + " written, " + str(self.num_deferred) +
+                " deferred, " + str(self.num_dropped) + " dropped, " + str(self.num_failed) + " failed")
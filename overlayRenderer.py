@@ -0,0 +1,84 @@
+# Python 3.6.5 script for drawing the measured particles over an image
+# Specifically draws the rotated best-fit rectangles of every particle, and
+# optionally their contours, with a single OpenCV call each instead of one call
+# per particle, onto a copy of the image that can be scaled down as a preview.
+
+# Imports:
+import cv2
+import numpy as np
+
+
+# Colours (blue, green, red) and line thicknesses the overlays are drawn with
+GREEN = (0,255,0)
+RED = (0,0,255)
+RECT_THICKNESS = 2
+CONTOUR_THICKNESS = 3
+
+# Number of fractional bits of the points handed to OpenCV when the overlay is
+# scaled down, so the rectangles and contours keep their sub-pixel positions
+SCALED_SHIFT = 4
+
+
+# Draw the rectangles of a ParticleTable's rects, and the contours if given, in
+# colour over a colour copy of img. The image itself is left as it was, since
+# frames can be read-only views of a raw stack or shared with other tiles. With
+# scale below 1 the copy is shrunk by that factor first, which makes a much
+# smaller preview image that is also quicker to draw and write out.
+def draw_overlay(img, rects, colour, contours = None, scale = 1.0):
+    overlay = colour_copy(img, scale)
+    if contours is not None and len(contours) > 0:
+        draw_polygons(overlay, contours, colour, CONTOUR_THICKNESS, scale)
+    if len(rects) > 0:
+        boxes = box_points(rects)
+        if scale >= 1:
+            boxes = boxes.astype(np.int32)
+        draw_polygons(overlay, list(boxes), colour, RECT_THICKNESS, scale)
+
+    return overlay
+
+
+# The 4 corners of every (center x, center y, width, height, angle) rectangle at
+# once, the same as cv2.boxPoints gives for each of them, as an n x 4 x 2 array
+def box_points(rects):
+    rects = np.asarray(rects, dtype = np.float32).reshape(-1, 5)
+    center_x, center_y, width, height = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+    angle = rects[:, 4].astype(np.float64) * np.pi / 180
+    b = np.cos(angle).astype(np.float32) * np.float32(0.5)
+    a = np.sin(angle).astype(np.float32) * np.float32(0.5)
+
+    points = np.empty((len(rects), 4, 2), dtype = np.float32)
+    points[:, 0, 0] = center_x - a * height - b * width
+    points[:, 0, 1] = center_y + b * height - a * width
+    points[:, 1, 0] = center_x + a * height - b * width
+    points[:, 1, 1] = center_y - b * height - a * width
+    points[:, 2, 0] = center_x + a * height + b * width
+    points[:, 2, 1] = center_y - b * height + a * width
+    points[:, 3, 0] = center_x - a * height + b * width
+    points[:, 3, 1] = center_y + b * height + a * width
+
+    return points
+
+
+# Colour copy of an image, shrunk by scale if it is below 1
+def colour_copy(img, scale):
+    if scale < 1:
+        img = cv2.resize(img, None, fx = scale, fy = scale, interpolation = cv2.INTER_AREA)
+        if img.ndim == 3:
+            return img
+
+    return cv2.cvtColor(img, cv2.COLOR_GRAY2BGR) if img.ndim == 2 else img.copy()
+
+
+# Draw closed polygons in one call. At full size the polygons must already be
+# int32 pixel positions. Scaled down, every point is scaled at once and drawn
+# with SCALED_SHIFT fractional bits.
+def draw_polygons(img, polygons, colour, thickness, scale):
+    if scale >= 1:
+        cv2.polylines(img, polygons, True, colour, thickness)
+        return
+
+    lengths = [len(polygon) for polygon in polygons]
+    points = np.concatenate([np.reshape(polygon, (-1, 2)) for polygon in polygons])
+    points = np.round(points * (scale * (1 << SCALED_SHIFT))).astype(np.int32)
+    cv2.polylines(img, np.split(points, np.cumsum(lengths)[:-1]), True, colour,
+                  max(1, int(round(thickness * scale))), cv2.LINE_8, SCALED_SHIFT)
@@ -0,0 +1,79 @@
+# Python 3.6.5 script holding the particle measurements of a single image
+# Specifically a compact, array-backed table with one column per field of the
+# data sheet, so results can be handed between threads and processes safely.
+
+# Imports:
+import numpy as np
+
+
+# Columns of the data sheet in the order they are written out
+COLUMNS = ["File_Name", "Pixel_Area", "Pixel_Diameter", "Contour_Area", "Contour_Diameter",
+           "Major_axis", "Minor_axis", "Aspect_Ratio", "Eccentricity", "Surface_Area",
+           "Sauter_Diameter", "Volume", "Sphericity", "X_coord", "Y_coord",
+           "Sobel_Max", "Mean_Gradient", "Laplacian_Var", "Track_ID", "Repeat"]
+
+# Columns holding the focus measures of each particle, any of which can be used
+# to decide whether a particle is clear enough to measure
+FOCUS_COLUMNS = ["Sobel_Max", "Mean_Gradient", "Laplacian_Var"]
+
+# Columns filled in by the particle tracker: the track a particle belongs to
+# (0 when particles are not tracked) and 1 if it was already seen in an
+# earlier image, such as a particle stuck in the flowcell
+TRACK_COLUMNS = ["Track_ID", "Repeat"]
+
+# Columns holding whole numbers
+INTEGER_COLUMNS = ["Pixel_Area"] + TRACK_COLUMNS
+
+# How the measurement columns are stored. The file name is the same for every
+# particle of an image, so it is only kept once per table.
+DTYPE = np.dtype([(name, np.int64 if name in INTEGER_COLUMNS else np.float64) for name in COLUMNS[1:]])
+
+
+# The measurements of every particle found in one image. data is a structured
+# array with one field per data sheet column, and rects holds the minimum area
+# rectangle (center x, center y, width, height, angle) of each particle. crops
+# optionally holds the cropped threshold image of each particle, metrics the
+# runMetrics record of the image, and cache_key the key the table is still to be
+# saved under in the result cache.
+class ParticleTable:
+    __slots__ = ("file_name", "data", "rects", "crops", "metrics", "cache_key")
+
+    def __init__(self, file_name, data, rects, crops = None, metrics = None):
+        self.file_name = file_name
+        self.data = data
+        self.rects = rects
+        self.crops = crops
+        self.metrics = metrics
+        self.cache_key = None
+
+    # Create a table of num_particles particles with every measurement zeroed
+    @classmethod
+    def empty(cls, file_name, num_particles):
+        return cls(file_name, np.zeros(num_particles, dtype = DTYPE),
+                   np.zeros((num_particles, 5), dtype = np.float64))
+
+    # Join the tables of parts of the same image into one table, in order
+    @classmethod
+    def concatenate(cls, file_name, tables):
+        if not tables:
+            return cls.empty(file_name, 0)
+
+        crops = None
+        if all(table.crops is not None for table in tables):
+            crops = [crop for table in tables for crop in table.crops]
+
+        return cls(file_name, np.concatenate([table.data for table in tables]),
+                   np.concatenate([table.rects for table in tables]), crops)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, column):
+        return self.data[column]
+
+    def __setitem__(self, column, values):
+        self.data[column] = values
+
+    # Rows of plain python values in the same order as COLUMNS
+    def rows(self):
+        return [(self.file_name,) + record for record in self.data.tolist()]
@@ -0,0 +1,83 @@
+# Python 3.6.5 script for following particles from one image to the next while they are analysed
+# Specifically matches each particle against the particles of the last few images
+# on position and area, so particles stuck in the flowcell are caught during a
+# run instead of afterwards with repeatParticleRemoval.py.
+
+# Imports:
+import collections
+import numpy as np
+from spatialIndex import GridIndex
+
+
+# Number of particles to see before judging whether the flowcell is dirty, so
+# a few repeats in the first images do not set off the warning
+MIN_PARTICLES_FOR_WARNING = 100
+
+
+# Gives every particle a track id, shared by particles in consecutive images
+# within positional_range pixels and area_range of each other, the same ranges
+# repeatParticleRemoval.py removes repeats with. Particles are only compared
+# against the particles of the last window images, which are kept in a grid so
+# each particle is only compared against its neighbours.
+class ParticleTracker:
+    def __init__(self, positional_range, area_range, window):
+        self.positional_range = positional_range
+        self.area_range = area_range
+        self.window = window
+        self.grid = GridIndex((positional_range, positional_range, area_range))
+        self.frames = collections.deque()
+        self.num_tracks = 0
+        self.num_particles = 0
+        self.num_repeats = 0
+        self.warned = False
+
+    # Fill in the Track_ID and Repeat columns of a ParticleTable. Particles
+    # matching one from an earlier image continue its track and count as repeats,
+    # the rest start new tracks.
+    def track(self, table):
+        points = [tuple(point) for point in
+                  np.column_stack([table["X_coord"], table["Y_coord"], table["Contour_Area"]]).tolist()]
+        track_ids = np.zeros(len(points), dtype = np.int64)
+        repeats = np.zeros(len(points), dtype = np.int64)
+        for i in range(len(points)):
+            for cmp_point, track_id in self.grid.nearby(points[i]):
+                if self.is_similar(points[i], cmp_point):
+                    track_ids[i] = track_id
+                    repeats[i] = 1
+                    break
+            else:
+                self.num_tracks = self.num_tracks + 1
+                track_ids[i] = self.num_tracks
+
+        # Only added once the whole image is matched, so particles are never
+        # matched against others in the same image
+        entries = list(zip(points, track_ids.tolist()))
+        for point, track_id in entries:
+            self.grid.insert(point, track_id)
+        self.frames.append(entries)
+        if len(self.frames) > self.window:
+            for point, track_id in self.frames.popleft():
+                self.grid.remove(point, track_id)
+
+        table["Track_ID"] = track_ids
+        table["Repeat"] = repeats
+        self.num_particles = self.num_particles + len(points)
+        self.num_repeats = self.num_repeats + int(repeats.sum())
+
+    # Whether two (x, y, area) points are within range of each other
+    def is_similar(self, point, cmp_point):
+        return (abs(point[0] - cmp_point[0]) <= self.positional_range and
+                abs(point[1] - cmp_point[1]) <= self.positional_range and
+                abs(point[2] - cmp_point[2]) <= self.area_range)
+
+    # Percentage of the particles so far that were repeats
+    def percent_repeats(self):
+        if self.num_particles == 0:
+            return 0.0
+
+        return self.num_repeats / self.num_particles * 100
+
+    # Whether enough of the particles so far were repeats for the flowcell to
+    # need cleaning
+    def is_dirty(self, max_percent):
+        return self.num_particles >= MIN_PARTICLES_FOR_WARNING and self.percent_repeats() >= max_percent
@@ -8,82 +8,88 @@ import sys
 import numpy as np
 import math
 from itertools import compress
-import xlsxwriter as xls
-import pandas as pd
-from determineParticleSizes import write_xl_summaries
+from resultStore import open_result_sink, read_result_rows
+from particleTable import COLUMNS
+from spatialIndex import GridIndex
 import pathlib
 
 
 # Global constants - FEEL FREE TO MODIFY
+# The original results may be an .xlsx, .csv or .sqlite file from determineParticleSizes,
+# and the filtered results are written in the format matching the extension of NEW_XL_FILENAME
 ORIGINAL_XL_FILENAME = str(pathlib.Path("../Test Images/First Sample Images/img_results/results_test.xlsx"))
 NEW_XL_FILENAME = str(pathlib.Path("../Test Images/First Sample Images/img_results/results_filtered.xlsx"))
 POSITIONAL_REMOVAL_RANGE = 0
 AREA_REMOVAL_RANGE = 0
 MAX_PERCENT_REMOVED = 5
 
+# Columns of the data sheet that particles are compared on
+X_COLUMN = "X_coord"
+Y_COLUMN = "Y_coord"
+AREA_COLUMN = "Contour_Area"
 
-def main():
-    xl_file = pd.ExcelFile(ORIGINAL_XL_FILENAME)
-    df_data = pd.read_excel(xl_file, 'data', header = 0)
-    # print(df_data)
 
-    idx_to_delete = cmp_particles_in_imgs(df_data)
-    idx_to_delete = set(idx_to_delete)
-    # print(idx_to_delete)
+def main():
+    # Only the filtered rows are written out, with a summary of them, as the
+    # original results are read a chunk at a time
+    sink = open_result_sink(NEW_XL_FILENAME, constant_memory = True)
+    num_rows, num_deleted = filter_results(ORIGINAL_XL_FILENAME, sink)
+    sink.close()
 
-    updated_df_data = df_data[~df_data.index.isin(idx_to_delete)]
-    # print(updated_df_data)
+    inform_dirty_state(num_rows, num_deleted)
 
-    # Write out updated dataframe to a new excel file
-    write_new_file(df_data, updated_df_data)
 
-    inform_dirty_state(df_data, idx_to_delete)
 
+# Copy the rows of the results file into sink, leaving out every row that
+# should be eliminated based on criteria (determined by the global ranges).
+# A row is eliminated if it is similar to any row before it. Returns the number
+# of rows read and the number eliminated.
+def filter_results(filename, sink):
+    num_rows = 0
+    num_deleted = 0
+    particle_columns = [COLUMNS.index(X_COLUMN), COLUMNS.index(Y_COLUMN), COLUMNS.index(AREA_COLUMN)]
 
+    # Index every particle seen so far on a grid so each particle is only
+    # compared against the particles in the neighbouring cells
+    grid = GridIndex((POSITIONAL_REMOVAL_RANGE, POSITIONAL_REMOVAL_RANGE, AREA_REMOVAL_RANGE))
 
-# Creates and returns a list of indexes corresponding to rows in the excel sheet
-# that should be eliminated based on criteria (determined by the global ranges)
-def cmp_particles_in_imgs(df_data):
-    idx_to_delete = []
-    numRows, numCols = df_data.shape
+    for rows in read_result_rows(filename):
+        kept_rows = []
+        for row in rows:
+            current_particle = tuple(row[i] for i in particle_columns)
+            if is_repeat_particle(grid, current_particle):
+                num_deleted = num_deleted + 1
+            else:
+                kept_rows.append(row)
 
-    # iterate through each individual particle to compare against others
-    for current_idx in range(numRows):
-        current_img = df_data.iloc[current_idx, 0]
-        # print("CURRENT IMAGE TO COMPARE AGAINST: " + current_img)
+            grid.insert(current_particle, num_rows)
+            num_rows = num_rows + 1
 
-        for cmp_idx in range(current_idx + 1, numRows):
-            # Skip particles associated with this same image
-            cmp_img = df_data.iloc[cmp_idx, 0]
-            # print("cmp_img: " + cmp_img)
+        sink.write_rows(kept_rows)
 
-            # If there are any repeats/similarities based on the global ranges,
-            # add them to the list to be removed
-            if (is_similar_particle(df_data, current_idx, cmp_idx)):
-                idx_to_delete.append(cmp_idx)
+    return num_rows, num_deleted
 
-    return idx_to_delete
 
+# Whether a particle repeats any of the particles indexed in grid so far
+def is_repeat_particle(grid, current_particle):
+    for cmp_particle, cmp_idx in grid.nearby(current_particle):
+        if is_similar_particle(cmp_particle, current_particle):
+            return True
 
-# Determine whether the particle being compared against the current particle
-# is the same (in terms of location or area)
-def is_similar_particle(df_data, current_idx, cmp_idx):
-    x_col_num = 12
-    y_col_num = 13
-    area_col_num = 3
+    return False
 
-    # current_row = df_data.iloc[[current_idx]]
-    x_min = df_data.iloc[current_idx, x_col_num] - POSITIONAL_REMOVAL_RANGE
 
+# Determine whether the particle being compared against the current particle
+# is the same (in terms of location or area). Particles are (x, y, area) tuples.
+def is_similar_particle(current_particle, cmp_particle):
+    x_min = current_particle[0] - POSITIONAL_REMOVAL_RANGE
     x_max = x_min + 2 * POSITIONAL_REMOVAL_RANGE
-    y_min = df_data.iloc[current_idx, y_col_num] - POSITIONAL_REMOVAL_RANGE
+    y_min = current_particle[1] - POSITIONAL_REMOVAL_RANGE
     y_max = y_min + 2 * POSITIONAL_REMOVAL_RANGE
-    area_min = df_data.iloc[current_idx, area_col_num] - AREA_REMOVAL_RANGE
+    area_min = current_particle[2] - AREA_REMOVAL_RANGE
     area_max = area_min + 2 * AREA_REMOVAL_RANGE
 
-    x_cmp = df_data.iloc[cmp_idx, x_col_num]
-    y_cmp = df_data.iloc[cmp_idx, y_col_num]
-    area_cmp = df_data.iloc[cmp_idx, area_col_num]
+    x_cmp, y_cmp, area_cmp = cmp_particle
 
     x_similar = x_cmp >= x_min and x_cmp <= x_max
     y_similar = y_cmp >= y_min and y_cmp <= y_max
@@ -92,35 +98,12 @@ def is_similar_particle(df_data, current_idx, cmp_idx):
     return area_similar and (x_similar and y_similar)
 
 
-# Write out updated filtered data to a new excel file, keeping the old data
-# in a 3rd sheet
-def write_new_file(df_data, updated_df_data):
-    # Rewrite old data and put in new filtered data
-    writer = pd.ExcelWriter(NEW_XL_FILENAME, engine = "xlsxwriter")
-    updated_df_data.to_excel(writer, sheet_name = "filtered_data", index = False)
-    df_data.to_excel(writer, sheet_name = "original_data", index = False)
-
-    wb = writer.book
-
-    # Set column widths for data sheets
-    for worksheet in wb.worksheets():
-        worksheet.set_column(0, 13, 15)
-
-    # Make summary sheet, set width and write out summary excel functions
-    summary_sheet = wb.add_worksheet("summary")
-    summary_sheet.set_column(0, 1, 25)
-    filtered_sheet = wb.get_worksheet_by_name("filtered_data")
-    numRows, numCols = updated_df_data.shape
-    write_xl_summaries(numRows, wb, filtered_sheet, summary_sheet)
-
-    writer.save()
-
-
 # If the percentage of removed particles reaches MAX_PERCENT_REMOVED, notify the
 # user that they should clean the flowcell.
-def inform_dirty_state(df_data, idx_to_delete):
-    numRows, numCols = df_data.shape
-    percent_removed = len(idx_to_delete) / numRows * 100
+def inform_dirty_state(numRows, numDeleted):
+    if numRows == 0:
+        return
+    percent_removed = numDeleted / numRows * 100
 
     if (percent_removed >= MAX_PERCENT_REMOVED):
         print("The flowcell is dirty and " + str(percent_removed) + "% of particles are repeats.")
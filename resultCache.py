@@ -0,0 +1,114 @@
+# Python 3.6.5 script for caching the particles found in each image on disk
+# Specifically stores the particles of every image analysed under a hash of the
+# image and of the settings that decide which particles are found, so rerunning
+# a folder with only the report settings changed skips the image processing.
+
+# Imports:
+import hashlib
+import json
+import os
+import pathlib
+import numpy as np
+from particleTable import ParticleTable, DTYPE, TRACK_COLUMNS
+
+
+# Changed whenever the analysis changes in a way that makes cached particles stale
+CACHE_VERSION = 1
+
+
+# Cache of ParticleTables in a folder, one .npz file per image. Only the
+# particles and their minimum area rectangles are kept, so the measurements that
+# depend on the pixel size or the particle height are worked out again on every
+# use. The track columns belong to a run rather than to the image, so they are
+# stored and handed back as 0. Once the files take up more than max_bytes, the
+# ones used longest ago are deleted. Entries are written whole and then renamed
+# into place, so several processes can read from the same cache while one writes
+# to it.
+class ResultCache:
+    def __init__(self, path, max_bytes):
+        self.path = pathlib.Path(str(path))
+        self.path.mkdir(parents = True, exist_ok = True)
+        self.max_bytes = max_bytes
+        self.size = None
+
+    # The key of an image analysed with the given settings, a dictionary of
+    # plain values
+    def key(self, img, settings):
+        digest = hashlib.sha256()
+        digest.update(json.dumps([CACHE_VERSION, settings, img.shape, str(img.dtype)], sort_keys = True).encode())
+        digest.update(np.ascontiguousarray(img).data)
+
+        return digest.hexdigest()
+
+    def entry_path(self, key):
+        return self.path / key[:2] / (key + ".npz")
+
+    # The cached ParticleTable of key, named file_name, or None if there is none
+    def get(self, key, file_name):
+        path = self.entry_path(key)
+        try:
+            with np.load(str(path)) as entry:
+                data = entry["data"]
+                rects = entry["rects"]
+            # Mark the entry as just used so it is the last to be evicted
+            os.utime(str(path))
+        except (OSError, ValueError, KeyError):
+            # Missing, or deleted or damaged while being read
+            return None
+
+        if data.dtype != DTYPE:
+            return None
+        clear_track_columns(data)
+
+        return ParticleTable(file_name, data, rects)
+
+    # Cache the particles of a table under key, evicting old entries if the
+    # cache has grown too big
+    def put(self, key, table):
+        path = self.entry_path(key)
+        path.parent.mkdir(exist_ok = True)
+        temp_path = path.with_name(key + "." + str(os.getpid()) + ".tmp")
+        data = table.data.copy()
+        clear_track_columns(data)
+        with open(str(temp_path), "wb") as file:
+            np.savez(file, data = data, rects = table.rects)
+        os.replace(str(temp_path), str(path))
+
+        if self.size is None:
+            self.size = sum(size for _, _, size in self.entries())
+        else:
+            self.size = self.size + path.stat().st_size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    # (last used, path, size in bytes) of every entry in the cache
+    def entries(self):
+        entries = []
+        for path in self.path.glob("*/*.npz"):
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, path, stat.st_size))
+
+        return entries
+
+    # Delete the entries used longest ago until the cache fits in max_bytes
+    def evict(self):
+        entries = sorted(self.entries())
+        self.size = sum(size for _, _, size in entries)
+        for _, path, size in entries:
+            if self.size <= self.max_bytes:
+                break
+            try:
+                path.unlink()
+            except OSError:
+                continue
+            self.size = self.size - size
+
+
+# Set the track columns of particle data to 0, as particles are only tracked
+# within a run
+def clear_track_columns(data):
+    for name in TRACK_COLUMNS:
+        data[name] = 0
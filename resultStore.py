@@ -0,0 +1,306 @@
+# Python 3.6.5 script for storing the results of the particle analysis
+# Specifically writes the columns of the data sheet out to an Excel, CSV or SQLite
+# file, and reads them back for exporting to Excel or further processing.
+
+# Imports:
+import csv
+import os
+import pathlib
+import sqlite3
+from particleTable import COLUMNS, INTEGER_COLUMNS
+from summaryStats import SummaryAccumulator
+
+
+# Name of the table (or sheet) the particle data is kept in
+DATA_TABLE = "data"
+
+# Number of rows read back at a time from a results file
+READ_CHUNK_SIZE = 10000
+
+# Rows of the summary sheet: the header, along with the function and the data
+# column it summarises. SAUTER is the Sauter mean diameter of all particles,
+# 6 x SUM(Volume) / SUM(Surface_Area), rather than an Excel function.
+SUMMARY_ROWS = [("AVG_PIXEL_AREA:", "AVERAGE", "Pixel_Area"),
+                ("AVG_PIXEL_DIAMETER:", "AVERAGE", "Pixel_Diameter"),
+                ("AVG_CONTOUR_AREA:", "AVERAGE", "Contour_Area"),
+                ("AVG_CONTOUR_DIAMETER:", "AVERAGE", "Contour_Diameter"),
+                ("AVG_MINOR_AXIS:", "AVERAGE", "Minor_axis"),
+                ("AVG_MAJOR_AXIS:", "AVERAGE", "Major_axis"),
+                ("AVG_ASPECT_RATIO:", "AVERAGE", "Aspect_Ratio"),
+                ("AVG_ECCENTRICITY:", "AVERAGE", "Eccentricity"),
+                ("MAX_ECCENTRICITY:", "MAX", "Eccentricity"),
+                ("MIN_PIXEL_AREA:", "MIN", "Pixel_Area"),
+                ("MAX_PIXEL_AREA:", "MAX", "Pixel_Area"),
+                ("SAUTER_MEAN_DIAMETER:", "SAUTER", "Sauter_Diameter"),
+                ("AVG_VOLUME:", "AVERAGE", "Volume"),
+                ("AVG_SPHERICITY:", "AVERAGE", "Sphericity"),
+                ("AVG_SURFACE_AREA:", "AVERAGE", "Surface_Area"),
+                ("PARTICLE_COUNT:", "COUNT", "Pixel_Area")]
+
+
+# Create the excel sheet to be edited. All data will end up in such a file called
+# 'results.xlsx'. With constant_memory, every row is flushed to disk once the next
+# one is started, so rows must be written in order.
+def setup_xl_file(xl_filename, constant_memory = False):
+    # Create excel file. xlsxwriter is only loaded once an Excel file is wanted.
+    import xlsxwriter as xls
+    workbook = xls.Workbook(str(xl_filename), {'constant_memory': constant_memory})
+    xl_sheet_data = workbook.add_worksheet(DATA_TABLE)
+    xl_sheet_summary = workbook.add_worksheet("summary")
+    bold = workbook.add_format({'bold': 1})
+    xl_sheet_data.set_column(0, len(COLUMNS) - 1, 15)
+    xl_sheet_summary.set_column(0, 1, 25)
+
+    #Write column headers for data
+    xl_sheet_data.write_row(0, 0, COLUMNS, bold)
+
+    return workbook, xl_sheet_data, xl_sheet_summary
+
+
+# Write out the data of a ParticleTable to the excel file starting at startRow.
+# Returns the number of rows written.
+def write_data_to_excel(table, startRow, xl_sheet_data):
+    return write_rows_to_excel(table.rows(), startRow, xl_sheet_data)
+
+
+# Write rows of particle data, ordered like COLUMNS, out to the data sheet
+# starting at startRow. Returns the number of rows written.
+def write_rows_to_excel(rows, startRow, xl_sheet_data):
+    for i in range(len(rows)):
+        row = startRow + i
+        xl_sheet_data.write(row, 0, rows[i][0])
+        for col in range(1, len(rows[i])):
+            xl_sheet_data.write_number(row, col, rows[i][col])
+
+    return len(rows)
+
+
+# Write the summary sheet with the overall area and diameter averages, minimums
+# and maximums. The values come from summary, a SummaryAccumulator of the data.
+# With formulas, the matching Excel functions over the data sheet are written as
+# well so the sheet updates if the data is edited. Without a summary only the
+# formulas are written and Excel fills in the values once it recalculates.
+def write_xl_summaries(numData, workbook, xl_sheet1, xl_sheet_summary, summary = None, formulas = True):
+    numData = str(numData)
+    name = xl_sheet1.get_name()
+
+    # Write the summary one row at a time so it also works for workbooks that
+    # were set up with constant_memory
+    bold = workbook.add_format({'bold': 1})
+    xl_sheet_summary.write('A1', 'SUMMARY', bold)
+    for i in range(len(SUMMARY_ROWS)):
+        label, function, column_name = SUMMARY_ROWS[i]
+        value = summary.value(function, column_name) if summary is not None else None
+        xl_sheet_summary.write(i + 1, 0, label, bold)
+
+        if formulas or summary is None:
+            if function == "SAUTER":
+                formula = ("=6*" + summary_function("SUM", "Volume", name, numData) + "/" +
+                           summary_function("SUM", "Surface_Area", name, numData))
+            else:
+                formula = "=" + summary_function(function, column_name, name, numData)
+            xl_sheet_summary.write_formula(i + 1, 1, formula, None, value if value is not None else 0)
+        elif value is not None:
+            xl_sheet_summary.write_number(i + 1, 1, value)
+
+
+# The Excel function summarising a column of the data sheet called name, whose
+# last row is numData, e.g. AVERAGE(data!B2:data!B101)
+def summary_function(function, column_name, name, numData):
+    column = chr(ord("A") + COLUMNS.index(column_name))
+
+    return function + "(" + name + "!" + column + "2:" + name + "!" + column + numData + ")"
+
+
+# The (header, value) pairs of the summary sheet calculated from a SummaryAccumulator
+def summary_values(summary):
+    return [(label, summary.value(function, column_name))
+            for label, function, column_name in SUMMARY_ROWS]
+
+
+# Result sink writing to an Excel workbook with a data and a summary sheet. The
+# summary is written once the sink is closed. Every sink keeps a running summary
+# of the rows written to it.
+class ExcelSink:
+    def __init__(self, filename, constant_memory = False, formulas = True):
+        self.workbook, self.xl_sheet_data, self.xl_sheet_summary = setup_xl_file(filename, constant_memory)
+        self.formulas = formulas
+        self.summary = SummaryAccumulator()
+        self.num_rows = 0
+
+    # Write out the rows of a ParticleTable. Returns the number of rows written.
+    def write(self, table):
+        return self.write_rows(table.rows())
+
+    def write_rows(self, rows):
+        self.num_rows = self.num_rows + write_rows_to_excel(rows, self.num_rows + 1, self.xl_sheet_data)
+        self.summary.add_rows(rows)
+
+        return len(rows)
+
+    def close(self):
+        write_xl_summaries(self.num_rows + 1, self.workbook, self.xl_sheet_data, self.xl_sheet_summary,
+                           self.summary, self.formulas)
+        self.workbook.close()
+
+
+# Result sink writing to a CSV file with a header row. Rows are flushed after
+# every table so the file can be read while the analysis is still running. The
+# summary is written to a second CSV file ending in _summary once the sink is closed.
+class CsvSink:
+    def __init__(self, filename):
+        self.filename = pathlib.Path(str(filename))
+        self.file = open(str(filename), "w", newline = "")
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(COLUMNS)
+        self.summary = SummaryAccumulator()
+        self.num_rows = 0
+
+    # Write out the rows of a ParticleTable. Returns the number of rows written.
+    def write(self, table):
+        return self.write_rows(table.rows())
+
+    def write_rows(self, rows):
+        self.writer.writerows(rows)
+        self.file.flush()
+        self.summary.add_rows(rows)
+        self.num_rows = self.num_rows + len(rows)
+
+        return len(rows)
+
+    def close(self):
+        self.file.close()
+
+        summary_filename = self.filename.with_name(self.filename.stem + "_summary.csv")
+        with open(str(summary_filename), "w", newline = "") as file:
+            writer = csv.writer(file)
+            writer.writerow(["SUMMARY", ""])
+            for label, value in summary_values(self.summary):
+                writer.writerow([label, "" if value is None else value])
+
+
+# Result sink writing to a table in an SQLite database file. Any existing file
+# is replaced, the same as with the other sinks. The summary is written to a
+# second table named summary once the sink is closed.
+class SqliteSink:
+    def __init__(self, filename):
+        if os.path.exists(str(filename)):
+            os.remove(str(filename))
+        self.connection = sqlite3.connect(str(filename))
+        column_types = ["TEXT"] + ["INTEGER" if name in INTEGER_COLUMNS else "REAL" for name in COLUMNS[1:]]
+        self.connection.execute("CREATE TABLE " + DATA_TABLE + " (" +
+                                ", ".join(name + " " + kind for name, kind in zip(COLUMNS, column_types)) + ")")
+        self.insert = ("INSERT INTO " + DATA_TABLE + " VALUES (" + ", ".join(["?"] * len(COLUMNS)) + ")")
+        self.summary = SummaryAccumulator()
+        self.num_rows = 0
+
+    # Write out the rows of a ParticleTable. Returns the number of rows written.
+    def write(self, table):
+        return self.write_rows(table.rows())
+
+    def write_rows(self, rows):
+        self.connection.executemany(self.insert, rows)
+        self.connection.commit()
+        self.summary.add_rows(rows)
+        self.num_rows = self.num_rows + len(rows)
+
+        return len(rows)
+
+    def close(self):
+        self.connection.execute("CREATE TABLE summary (label TEXT, value REAL)")
+        self.connection.executemany("INSERT INTO summary VALUES (?, ?)", summary_values(self.summary))
+        self.connection.commit()
+        self.connection.close()
+
+
+# Open the sink matching the file extension of filename: .xlsx for Excel, .csv
+# for CSV and .sqlite or .db for SQLite
+def open_result_sink(filename, constant_memory = False, formulas = True):
+    suffix = pathlib.Path(str(filename)).suffix.lower()
+    if suffix == ".xlsx":
+        return ExcelSink(filename, constant_memory, formulas)
+    if suffix == ".csv":
+        return CsvSink(filename)
+    if suffix in (".sqlite", ".db"):
+        return SqliteSink(filename)
+
+    raise ValueError("Unknown results file type: " + str(filename))
+
+
+# Make a function that turns a row read back from a results file with the given
+# header into a tuple ordered like COLUMNS, with every value of its proper type.
+# Columns missing from the file, such as those added since it was written, are
+# filled in with 0.
+def row_parser(header):
+    header = [str(name) for name in header]
+    positions = [header.index(name) if name in header else None for name in COLUMNS]
+    kinds = [str] + [int if name in INTEGER_COLUMNS else float for name in COLUMNS[1:]]
+    fields = list(zip(positions, kinds))
+
+    def parse_row(row):
+        return tuple(kind(row[position]) if position is not None else kind(0)
+                     for position, kind in fields)
+
+    return parse_row
+
+
+# Group rows into lists of up to READ_CHUNK_SIZE rows, each turned into its
+# proper types by parse_row
+def chunk_rows(rows, parse_row):
+    chunk = []
+    for row in rows:
+        chunk.append(parse_row(row))
+        if len(chunk) == READ_CHUNK_SIZE:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Read the particle data rows back out of a results file written by any of the
+# sinks, READ_CHUNK_SIZE rows at a time. Only one chunk is held in memory at a
+# time. Yields lists of tuples ordered like COLUMNS, typed the same way as the
+# rows of a ParticleTable.
+def read_result_rows(filename):
+    suffix = pathlib.Path(str(filename)).suffix.lower()
+    if suffix == ".csv":
+        with open(str(filename), newline = "") as file:
+            reader = csv.reader(file)
+            header = next(reader)
+            for chunk in chunk_rows(reader, row_parser(header)):
+                yield chunk
+    elif suffix in (".sqlite", ".db"):
+        connection = sqlite3.connect(str(filename))
+        try:
+            cursor = connection.execute("SELECT * FROM " + DATA_TABLE)
+            parse_row = row_parser([column[0] for column in cursor.description])
+            while True:
+                chunk = cursor.fetchmany(READ_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield [parse_row(row) for row in chunk]
+        finally:
+            connection.close()
+    elif suffix == ".xlsx":
+        import openpyxl
+        workbook = openpyxl.load_workbook(str(filename), read_only = True)
+        try:
+            rows = workbook[DATA_TABLE].iter_rows(values_only = True)
+            header = next(rows, ())
+            # Skip empty rows left over at the end of a sheet
+            rows = (row for row in rows if row[0] is not None)
+            for chunk in chunk_rows(rows, row_parser(header)):
+                yield chunk
+        finally:
+            workbook.close()
+    else:
+        raise ValueError("Unknown results file type: " + str(filename))
+
+
+# Generate an Excel workbook, with its data and summary sheets, from a results
+# file written by any of the sinks
+def export_excel(filename, xl_filename, formulas = True):
+    sink = ExcelSink(xl_filename, constant_memory = True, formulas = formulas)
+    for rows in read_result_rows(filename):
+        sink.write_rows(rows)
+    sink.close()
@@ -0,0 +1,184 @@
+# Python 3.6.5 script for measuring where the time and memory of a run goes
+# Specifically times the stages of the analysis of each image, keeps counters
+# such as the number of contours found, and reports on all of them once the run ends.
+
+# Imports:
+import csv
+import json
+import sys
+import threading
+import time
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, where peak memory is simply not reported
+    resource = None
+
+
+# Record of the image currently being analysed by this process, or None when
+# metrics are not being collected. Records are plain dictionaries so they can be
+# handed back from worker processes along with the results.
+current = None
+
+# Records of every image of the run, kept by the main process
+records = []
+
+# Images analysed in tiles add to the same record from several threads
+lock = threading.Lock()
+
+
+# Does nothing, so timing a stage costs next to nothing when metrics are off
+class NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = NullStage()
+
+
+# Adds the seconds spent inside its with block to a stage of a record
+class Stage:
+    def __init__(self, record, name):
+        self.record = record
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        with lock:
+            stages = self.record["stages"]
+            stages[self.name] = stages.get(self.name, 0.0) + seconds
+        return False
+
+
+# Start collecting metrics for an image
+def begin_image(file_name):
+    global current
+    current = {"file_name": file_name, "stages": {}, "values": {}}
+
+
+# Carry on collecting metrics for an image whose record was handed back by
+# end_image, such as one that was analysed by a worker process
+def resume_image(record):
+    global current
+    current = record
+
+
+# Stop collecting metrics for the current image and return its record, along
+# with the peak memory of the process that analysed it
+def end_image():
+    global current
+    record = current
+    current = None
+    if record is not None:
+        record.setdefault("peak_rss_mb", peak_rss_mb())
+
+    return record
+
+
+# Time a stage of the current image, to be used as "with stage(name):"
+def stage(name):
+    if current is None:
+        return NULL_STAGE
+
+    return Stage(current, name)
+
+
+# Keep a value, such as a count or an image dimension, for the current image
+def note(name, value):
+    if current is not None:
+        current["values"][name] = value
+
+
+# Add to a count kept for the current image, such as the number of contours
+def add(name, value):
+    if current is not None:
+        with lock:
+            values = current["values"]
+            values[name] = values.get(name, 0) + value
+
+
+# Keep the record of a finished image for the report
+def add_record(record):
+    if record is not None:
+        records.append(record)
+
+
+# The most memory this process has used so far in megabytes, if it can be found
+def peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == "darwin":
+        return peak / (1024 * 1024)
+    return peak / 1024
+
+
+# Names of every stage and value seen in the records, in the order first seen
+def record_keys(key):
+    names = []
+    for record in records:
+        for name in record[key]:
+            if name not in names:
+                names.append(name)
+
+    return names
+
+
+# The 50th and 95th percentile time and the share of the total time of every stage
+def stage_summary():
+    summary = {}
+    totals = {name: sum(record["stages"].get(name, 0.0) for record in records)
+              for name in record_keys("stages")}
+    total = sum(totals.values())
+    for name in totals:
+        times = [record["stages"][name] for record in records if name in record["stages"]]
+        summary[name] = {"p50": float(np.percentile(times, 50)), "p95": float(np.percentile(times, 95)),
+                         "share": totals[name] / total if total > 0 else 0.0}
+
+    return summary
+
+
+# Write the records, with a summary of the run, to filename. A .csv file gets
+# one row per image, anything else is written as JSON.
+def write_report(filename, run_values):
+    if str(filename).lower().endswith(".csv"):
+        stage_names = record_keys("stages")
+        value_names = record_keys("values")
+        with open(str(filename), "w", newline = "") as file:
+            writer = csv.writer(file)
+            writer.writerow(["file_name"] + [name + "_seconds" for name in stage_names] +
+                            value_names + ["peak_rss_mb"])
+            for record in records:
+                writer.writerow([record["file_name"]] +
+                                [record["stages"].get(name, "") for name in stage_names] +
+                                [record["values"].get(name, "") for name in value_names] +
+                                [record.get("peak_rss_mb", "")])
+    else:
+        with open(str(filename), "w") as file:
+            json.dump({"run": run_values, "stages": stage_summary(), "images": records}, file, indent = 2)
+
+
+# Print the 50th and 95th percentile time of every stage, in milliseconds, with
+# its share of the total time
+def print_summary(run_values):
+    if not records:
+        return
+
+    print("Metrics for " + str(len(records)) + " images (p50 / p95 per image, share of time):")
+    for name, summary in stage_summary().items():
+        print("    " + name.ljust(16) + str(round(summary["p50"] * 1000, 1)).rjust(10) + " ms" +
+              str(round(summary["p95"] * 1000, 1)).rjust(10) + " ms" +
+              str(round(summary["share"] * 100, 1)).rjust(7) + "%")
+    for name, value in run_values.items():
+        print("    " + name + ": " + str(value))
@@ -0,0 +1,47 @@
+# Python 3.6.5 script for quickly finding particles that are close to each other
+# Specifically a uniform grid hash over particle measurements such as position
+# and area, so only particles in neighbouring cells have to be compared.
+
+# Imports:
+import itertools
+import math
+
+
+# A uniform grid over points with any number of dimensions. Each dimension has
+# its own cell size, usually the largest difference two points may have in it
+# to still count as close. A cell size of 0 only matches identical values.
+class GridIndex:
+    def __init__(self, cell_sizes):
+        self.cell_sizes = tuple(cell_sizes)
+        self.cells = {}
+
+        # Points within range always fall into the same or a neighbouring cell
+        self.offsets = list(itertools.product(*[(-1, 0, 1) if size > 0 else (0,)
+                                                for size in self.cell_sizes]))
+
+    # Find the grid cell a point belongs to
+    def cell_of(self, point):
+        return tuple(math.floor(value / size) if size > 0 else value
+                     for value, size in zip(point, self.cell_sizes))
+
+    # Add a point to the grid, along with an item to hand back when it is found
+    def insert(self, point, item):
+        self.cells.setdefault(self.cell_of(point), []).append((point, item))
+
+    # Take a point added with insert() back out of the grid
+    def remove(self, point, item):
+        key = self.cell_of(point)
+        entries = self.cells[key]
+        entries.remove((point, item))
+        if not entries:
+            del self.cells[key]
+
+    # Yield the (point, item) pairs stored in the cells around a point. These
+    # are only candidates, so callers still have to check the actual ranges.
+    def nearby(self, point):
+        key = self.cell_of(point)
+        for offset in self.offsets:
+            cell = tuple(k + o for k, o in zip(key, offset))
+            for entry in self.cells.get(cell, ()):
+                yield entry
+
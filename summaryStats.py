@@ -0,0 +1,74 @@
+# Python 3.6.5 script for summarising particle measurements while they are analysed
+# Specifically keeps running counts, sums, minimums and maximums of every data
+# sheet column as the rows are written, so the summary never needs the whole
+# data sheet in memory.
+
+# Imports:
+import numpy as np
+from particleTable import COLUMNS
+
+
+# Columns of the data sheet that hold numbers and can be summarised
+NUMERIC_COLUMNS = COLUMNS[1:]
+
+
+# Running count, sum, minimum and maximum of every numeric data sheet column.
+# Result sinks add every row they write, whichever image or worker it came from.
+class SummaryAccumulator:
+    def __init__(self):
+        self.count = 0
+        self.sums = np.zeros(len(NUMERIC_COLUMNS))
+        self.mins = np.full(len(NUMERIC_COLUMNS), np.inf)
+        self.maxs = np.full(len(NUMERIC_COLUMNS), -np.inf)
+
+    # Add a block of particles given as a 2D array with one column per entry of
+    # NUMERIC_COLUMNS
+    def add_values(self, values):
+        if len(values) == 0:
+            return
+        self.count = self.count + len(values)
+        self.sums = self.sums + values.sum(axis = 0)
+        self.mins = np.minimum(self.mins, values.min(axis = 0))
+        self.maxs = np.maximum(self.maxs, values.max(axis = 0))
+
+    # Add every particle of a ParticleTable
+    def add_table(self, table):
+        self.add_columns(table.data)
+
+    # Add particles from anything that can be indexed by column name, such as the
+    # structured array of a ParticleTable
+    def add_columns(self, columns):
+        self.add_values(np.column_stack([np.asarray(columns[name], dtype = np.float64)
+                                         for name in NUMERIC_COLUMNS]))
+
+    # Add rows of particle data ordered like COLUMNS
+    def add_rows(self, rows):
+        self.add_values(np.array([row[1:] for row in rows], dtype = np.float64).reshape(-1, len(NUMERIC_COLUMNS)))
+
+    # Calculate a summary value of a column, where function is one of the Excel
+    # functions AVERAGE, SUM, MIN, MAX or COUNT, or SAUTER for the Sauter mean
+    # diameter (D32) of every particle, 6 x total volume / total surface area,
+    # whatever the column. Returns None if nothing has been added yet, matching
+    # the empty cell Excel would show.
+    def value(self, function, column):
+        if self.count == 0:
+            return None
+
+        if function == "SAUTER":
+            volume = self.sums[NUMERIC_COLUMNS.index("Volume")]
+            surface_area = self.sums[NUMERIC_COLUMNS.index("Surface_Area")]
+            return float(6 * volume / surface_area)
+
+        i = NUMERIC_COLUMNS.index(column)
+        if function == "AVERAGE":
+            return float(self.sums[i] / self.count)
+        if function == "SUM":
+            return float(self.sums[i])
+        if function == "MIN":
+            return float(self.mins[i])
+        if function == "MAX":
+            return float(self.maxs[i])
+        if function == "COUNT":
+            return self.count
+
+        raise ValueError("Unknown summary function: " + function)
@@ -4,11 +4,17 @@
 
 # Imports:
 import determineParticleSizes
+import repeatParticleRemoval
+import resultStore
+import summaryStats
+import overlayRenderer
+from particleTable import ParticleTable, COLUMNS, INTEGER_COLUMNS
+from particleTracker import ParticleTracker, MIN_PARTICLES_FOR_WARNING
 import cv2
-import pathlib
 import numpy as np
-import pandas as pd
-import openpyxl
+import pathlib
+import shutil
+import tempfile
 
 
 # Constants:
@@ -40,6 +46,18 @@ def main():
     test_set3()
     test_set4()
 
+    # Test rerunning a folder with the result cache
+    test_result_cache()
+
+    # Test filtering repeated particles out of results files
+    test_dedupe()
+
+    # Test following particles from one image to the next
+    test_tracking()
+
+    # Wait for the debug images to finish writing
+    determineParticleSizes.close_image_writer()
+
     # Print out the total number of passed and failed tests!
     print_summary()
 
@@ -51,31 +69,33 @@ def test_individual_uniform_img(set_name, file_num, expect_count, expect_area, e
 
     # Setup individual excel file for this current image
     determineParticleSizes.RESULTS_FILENAME = file_path + "_results.xlsx"
-    workbook, xl_sheet_data, xl_sheet_summary = determineParticleSizes.setup_xl_file()
+    workbook, xl_sheet_data, xl_sheet_summary = resultStore.setup_xl_file(determineParticleSizes.RESULTS_FILENAME)
 
     # Test if particle count is correct
     startRow = 1
-    num_particles = determineParticleSizes.analyse(test_img, startRow, file_num, xl_sheet_data)
+    table = determineParticleSizes.analyse(test_img, pathlib.Path(file_path).name)
+    num_particles = resultStore.write_data_to_excel(table, startRow, xl_sheet_data)
     print_result(file_path, num_particles == expect_count, "particle count", expect_count, num_particles)
 
     # Test if pixel_areas are uniformly correct
-    print_result(file_path, verify_list(determineParticleSizes.pixel_areas, expect_area, None),
-        "pixel area", expect_area, determineParticleSizes.pixel_areas)
+    print_result(file_path, verify_list(table["Pixel_Area"], expect_area, None),
+        "pixel area", expect_area, table["Pixel_Area"])
 
     # Test if pixel_diameters are uniformly correct
-    print_result(file_path, verify_list(determineParticleSizes.pixel_diameters, expect_diameter, None),
-        "pixel_diameter", expect_diameter, determineParticleSizes.pixel_diameters)
+    print_result(file_path, verify_list(table["Pixel_Diameter"], expect_diameter, None),
+        "pixel_diameter", expect_diameter, table["Pixel_Diameter"])
     print("\n")
 
     # Draw the bounding rectangles and contours on the image for ease of viewing
     test_img = determineParticleSizes.crop_left_border(test_img)
-    draw_contours_and_rects(test_img, file_num, set_name)
+    draw_contours_and_rects(test_img, file_num, set_name, table)
 
     # Write out summary of averages, mins, and maxes out to the excel file
-    determineParticleSizes.write_xl_summaries(startRow, workbook, xl_sheet_data, xl_sheet_summary)
+    summary = summaryStats.SummaryAccumulator()
+    summary.add_table(table)
+    resultStore.write_xl_summaries(startRow + num_particles, workbook, xl_sheet_data, xl_sheet_summary, summary)
 
     workbook.close()
-    determineParticleSizes.clear_lists()
 
 
 # Gather the test image to analyse
@@ -118,12 +138,8 @@ def print_result(file_path, condition, test_type, expect_val, actual_val):
 
 # Draws and saves a version of the current test image with the bounding min area rectangles
 # drawn on top
-def draw_contours_and_rects(test_img, file_num, set_name):
-    for i in range(len(determineParticleSizes.filtered_min_area_rects)):
-        # Draw rotated best-fit rectangles
-        rotated_rect = cv2.boxPoints(determineParticleSizes.filtered_min_area_rects[i])
-        rotated_rect = np.int0(rotated_rect)
-        cv2.drawContours(test_img, [rotated_rect], -1, (0,0,255), 2)
+def draw_contours_and_rects(test_img, file_num, set_name, table):
+    test_img = overlayRenderer.draw_overlay(test_img, table.rects, overlayRenderer.RED)
 
     results_path = str(pathlib.Path(TEST_FOLDER + set_name + "/" + IMG_RESULTS_FOLDER + "/rect_og_image_" + str(file_num) + ".bmp"))
     cv2.imwrite(results_path, test_img)
@@ -191,11 +207,12 @@ def test_set3():
 
     # Setup individual excel file for this current image
     determineParticleSizes.RESULTS_FILENAME = file_path + "_results.xlsx"
-    workbook, xl_sheet_data, xl_sheet_summary = determineParticleSizes.setup_xl_file()
+    workbook, xl_sheet_data, xl_sheet_summary = resultStore.setup_xl_file(determineParticleSizes.RESULTS_FILENAME)
 
     # Test if particle count is correct
     startRow = 1
-    num_particles = determineParticleSizes.analyse(test_img, startRow, file_num, xl_sheet_data)
+    table = determineParticleSizes.analyse(test_img, pathlib.Path(file_path).name)
+    num_particles = resultStore.write_data_to_excel(table, startRow, xl_sheet_data)
 
     # Check the amount of particles captured is correct
     expect_count = 10
@@ -203,18 +220,20 @@ def test_set3():
 
     # Check the areas against this list
     expected_areas = [400, 225, 100, 81, 64, 49, 36, 16, 9, 4]
-    print_result(file_path, verify_list(determineParticleSizes.pixel_areas, None, expected_areas),
-        "pixel area", expected_areas, determineParticleSizes.pixel_areas)
+    print_result(file_path, verify_list(table["Pixel_Area"], None, expected_areas),
+        "pixel area", expected_areas, table["Pixel_Area"])
 
     # Test if pixel_diameters are uniformly correct
     expected_diameters = [20, 15, 10, 9, 8, 7, 6, 4, 3, 2]
-    print_result(file_path, verify_list(determineParticleSizes.pixel_diameters, None, expected_diameters),
-        "pixel_diameter", expected_diameters, determineParticleSizes.pixel_diameters)
+    print_result(file_path, verify_list(table["Pixel_Diameter"], None, expected_diameters),
+        "pixel_diameter", expected_diameters, table["Pixel_Diameter"])
     print("\n")
 
-    draw_contours_and_rects(test_img, file_num, SET3_FOLDER)
+    draw_contours_and_rects(test_img, file_num, SET3_FOLDER, table)
 
-    determineParticleSizes.write_xl_summaries(startRow, workbook, xl_sheet_data, xl_sheet_summary)
+    summary = summaryStats.SummaryAccumulator()
+    summary.add_table(table)
+    resultStore.write_xl_summaries(startRow + num_particles, workbook, xl_sheet_data, xl_sheet_summary, summary)
     workbook.close()
 
 
@@ -224,9 +243,10 @@ def test_3D_set(shape_type, expect_surf_area, expect_vol):
     determineParticleSizes.IMAGE_FOLDER_PATH = TEST_FOLDER + "/" + SET4_FOLDER + "/"
     pathlib.Path(determineParticleSizes.IMAGE_FOLDER_PATH + IMG_RESULTS_FOLDER).mkdir(exist_ok = True)
     determineParticleSizes.RESULTS_FILENAME = pathlib.Path(determineParticleSizes.IMAGE_FOLDER_PATH + shape_type + "_results.xlsx")
-    workbook, xl_sheet_data, xl_sheet_summary = determineParticleSizes.setup_xl_file()
+    workbook, xl_sheet_data, xl_sheet_summary = resultStore.setup_xl_file(determineParticleSizes.RESULTS_FILENAME)
 
     startRow = 1
+    summary = summaryStats.SummaryAccumulator()
     # Analyse 5 images of the same shape at a time, and have the results compiled in an excel sheet
     for i in range(1, 6):
         # Retrieve file to test
@@ -234,12 +254,12 @@ def test_3D_set(shape_type, expect_surf_area, expect_vol):
         img = cv2.imread(determineParticleSizes.IMAGE_FOLDER_PATH + file_name)
 
         # Analyse file
-        num_particles = determineParticleSizes.analyse(img, startRow, i, xl_sheet_data)
-        startRow = startRow + num_particles
-        determineParticleSizes.clear_lists()
+        table = determineParticleSizes.analyse(img, shape_type + " (" + str(i) + ")")
+        startRow = startRow + resultStore.write_data_to_excel(table, startRow, xl_sheet_data)
+        summary.add_table(table)
 
     # Write out summary sheet to excel workbook
-    determineParticleSizes.write_xl_summaries(startRow, workbook, xl_sheet_data, xl_sheet_summary)
+    resultStore.write_xl_summaries(startRow, workbook, xl_sheet_data, xl_sheet_summary, summary)
     workbook.close()
 
     verify_avg_measures(expect_surf_area, expect_vol)
@@ -249,12 +269,11 @@ def test_3D_set(shape_type, expect_surf_area, expect_vol):
 # the expected values. Print out results.
 def verify_avg_measures(expect_surf_area, expect_vol):
     # Obtain the values in the summary sheet for comparison
+    import openpyxl
     wb = openpyxl.load_workbook(filename=determineParticleSizes.RESULTS_FILENAME, data_only=True)
     sheet = wb["summary"]
-    # summary_surf_area = float(sheet['B16'].value)
-    # summary_vol = float(sheet['B14'].value)
-    summary_surf_area = float(sheet['B16'].internal_value)
-    summary_vol = float(sheet['B14'].internal_value)
+    summary_surf_area = float(sheet['B16'].value)
+    summary_vol = float(sheet['B14'].value)
 
     # Find range of error
     surf_area_min, surf_area_max = reasonable_error(expect_surf_area)
@@ -288,6 +307,187 @@ def test_set4():
     test_3D_set("pyr", 5708.42, 24696)
 
 
+# Settings of determineParticleSizes changed by the folder tests, put back afterwards
+def script_settings(names):
+    return {name: getattr(determineParticleSizes, name) for name in names}
+
+
+def restore_settings(settings):
+    for name, value in settings.items():
+        setattr(determineParticleSizes, name, value)
+
+
+# Read the Track_ID and Repeat columns of a results file
+def read_track_columns(filename):
+    track_ids = []
+    repeats = []
+    for rows in resultStore.read_result_rows(filename):
+        track_ids.extend(row[COLUMNS.index("Track_ID")] for row in rows)
+        repeats.extend(row[COLUMNS.index("Repeat")] for row in rows)
+
+    return track_ids, repeats
+
+
+# Analyses a folder holding the same image three times with particle tracking and
+# the result cache on, so the last two images are repeats, then analyses it again
+# from the cache without tracking. Cached particles must not bring the track
+# columns of the first run back with them. A run saving crops must leave the
+# cache alone.
+def test_result_cache():
+    settings = script_settings(["IMAGE_FOLDER_PATH", "TEST_RESULTS_PATH", "RESULTS_FILENAME", "TEST", "DEBUG_STAGES",
+                                "RESULT_CACHE_PATH", "TRACK_PARTICLES", "NUM_WORKERS", "WATCH_FOLDER"])
+    img_path = TEST_FOLDER + "/" + SET1_FOLDER + "/" + SET1_FOLDER + "_Image2.bmp"
+    with tempfile.TemporaryDirectory() as folder:
+        for name in ["a.bmp", "b.bmp", "c.bmp"]:
+            shutil.copy(img_path, folder + "/" + name)
+        determineParticleSizes.IMAGE_FOLDER_PATH = folder
+        determineParticleSizes.TEST_RESULTS_PATH = folder + "/" + IMG_RESULTS_FOLDER
+        determineParticleSizes.RESULTS_FILENAME = folder + "/results.csv"
+        determineParticleSizes.RESULT_CACHE_PATH = folder + "/cache"
+        determineParticleSizes.NUM_WORKERS = 1
+        determineParticleSizes.WATCH_FOLDER = False
+
+        try:
+            determineParticleSizes.TEST = True
+            determineParticleSizes.DEBUG_STAGES = ["crops"]
+            determineParticleSizes.main(ask_height = False)
+            num_entries = len(list(pathlib.Path(folder + "/cache").glob("*/*.npz")))
+            print_result(img_path, num_entries == 0, "cache entries while saving crops", 0, num_entries)
+
+            determineParticleSizes.TEST = False
+            determineParticleSizes.TRACK_PARTICLES = True
+            determineParticleSizes.main(ask_height = False)
+            track_ids, repeats = read_track_columns(determineParticleSizes.RESULTS_FILENAME)
+            print_result(img_path, sum(repeats) == 200, "tracked repeats", 200, sum(repeats))
+
+            determineParticleSizes.TRACK_PARTICLES = False
+            determineParticleSizes.main(ask_height = False)
+            track_ids, repeats = read_track_columns(determineParticleSizes.RESULTS_FILENAME)
+            print_result(img_path, len(track_ids) == 300 and not any(track_ids) and not any(repeats),
+                "cached track columns", "300 rows of 0", (len(track_ids), sum(track_ids), sum(repeats)))
+        finally:
+            restore_settings(settings)
+            determineParticleSizes.result_cache = None
+
+
+# Make num_rows random result rows, ordered like COLUMNS. Positions and areas are
+# whole numbers in a small range so plenty of particles repeat each other. Other
+# measurements have 6 decimals, few enough for every file type to keep exactly.
+def random_result_rows(num_rows, seed):
+    rng = np.random.RandomState(seed)
+    rows = []
+    for i in range(num_rows):
+        values = {name: int(rng.randint(0, 1000)) if name in INTEGER_COLUMNS else round(float(rng.uniform(0, 1000)), 6)
+                  for name in COLUMNS[1:]}
+        values["X_coord"] = float(rng.randint(0, 20))
+        values["Y_coord"] = float(rng.randint(0, 20))
+        values["Contour_Area"] = float(rng.randint(0, 10))
+        rows.append(tuple(["image_" + str(i // 50)] + [values[name] for name in COLUMNS[1:]]))
+
+    return rows
+
+
+# The rows repeatParticleRemoval should keep, found by comparing every row with
+# every row before it
+def brute_force_kept_rows(rows, positional_range, area_range):
+    x, y, area = COLUMNS.index("X_coord"), COLUMNS.index("Y_coord"), COLUMNS.index("Contour_Area")
+    kept = []
+    for i in range(len(rows)):
+        repeat = False
+        for j in range(i):
+            if (abs(rows[i][x] - rows[j][x]) <= positional_range and abs(rows[i][y] - rows[j][y]) <= positional_range
+                    and abs(rows[i][area] - rows[j][area]) <= area_range):
+                repeat = True
+                break
+        if not repeat:
+            kept.append(rows[i])
+
+    return kept
+
+
+# Writes random results as .csv, .sqlite and .xlsx files, filters them with
+# repeatParticleRemoval and checks the rows kept, as read back from the filtered
+# file, against a brute force comparison of every pair of rows. Rows are read in
+# small chunks so particles are also matched across chunks.
+def test_dedupe():
+    ranges = [repeatParticleRemoval.POSITIONAL_REMOVAL_RANGE, repeatParticleRemoval.AREA_REMOVAL_RANGE]
+    chunk_size = resultStore.READ_CHUNK_SIZE
+    rows = random_result_rows(400, 0)
+    resultStore.READ_CHUNK_SIZE = 64
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for positional_range, area_range in [(0, 0), (2.5, 3)]:
+                repeatParticleRemoval.POSITIONAL_REMOVAL_RANGE = positional_range
+                repeatParticleRemoval.AREA_REMOVAL_RANGE = area_range
+                expect_rows = brute_force_kept_rows(rows, positional_range, area_range)
+                for suffix in [".csv", ".sqlite", ".xlsx"]:
+                    original = folder + "/original" + suffix
+                    sink = resultStore.open_result_sink(original)
+                    sink.write_rows(rows)
+                    sink.close()
+
+                    filtered = folder + "/filtered" + suffix
+                    sink = resultStore.open_result_sink(filtered)
+                    num_rows, num_deleted = repeatParticleRemoval.filter_results(original, sink)
+                    sink.close()
+                    kept_rows = [row for chunk in resultStore.read_result_rows(filtered) for row in chunk]
+
+                    test_name = "dedupe " + suffix + " with ranges " + str((positional_range, area_range))
+                    print_result(original, num_rows == len(rows) and num_deleted == len(rows) - len(expect_rows),
+                        test_name + " deletions", len(rows) - len(expect_rows), num_deleted)
+                    print_result(original, kept_rows == expect_rows, test_name + " kept rows",
+                        len(expect_rows), len(kept_rows))
+    finally:
+        repeatParticleRemoval.POSITIONAL_REMOVAL_RANGE, repeatParticleRemoval.AREA_REMOVAL_RANGE = ranges
+        resultStore.READ_CHUNK_SIZE = chunk_size
+
+
+# Make a ParticleTable of particles at the given (x, y, area) points
+def point_table(file_name, points):
+    table = ParticleTable.empty(file_name, len(points))
+    if points:
+        table["X_coord"], table["Y_coord"], table["Contour_Area"] = [list(values) for values in zip(*points)]
+
+    return table
+
+
+# Tracks small made up images: matching particles within one image must not be
+# repeats, particles must stop being matched once their image leaves the window,
+# and the dirty flowcell warning must wait for MIN_PARTICLES_FOR_WARNING particles
+def test_tracking():
+    test_name = "particleTracker"
+    tracker = ParticleTracker(1, 2, 2)
+    first = point_table("first", [(10, 10, 50), (10, 10, 50), (30, 30, 20)])
+    tracker.track(first)
+    print_result(test_name, list(first["Repeat"]) == [0, 0, 0] and list(first["Track_ID"]) == [1, 2, 3],
+        "same image repeats", [0, 0, 0], list(first["Repeat"]))
+
+    second = point_table("second", [(11, 9, 52), (30, 32, 20), (70, 70, 5)])
+    tracker.track(second)
+    print_result(test_name, list(second["Repeat"]) == [1, 0, 0] and list(second["Track_ID"]) == [1, 4, 5],
+        "repeats within range", [1, 0, 0], list(second["Repeat"]))
+
+    # The window holds 2 images, so the first image leaves it once the third is
+    # tracked while the second is still matched against the fourth
+    tracker.track(point_table("third", [(100, 100, 10)]))
+    fourth = point_table("fourth", [(30, 30, 20), (70, 70, 5)])
+    tracker.track(fourth)
+    print_result(test_name, list(fourth["Repeat"]) == [0, 1], "window slid past", [0, 1], list(fourth["Repeat"]))
+    num_entries = sum(len(entries) for entries in tracker.grid.cells.values())
+    print_result(test_name, num_entries == 3, "particles left in the window", 3, num_entries)
+
+    # Half of the particles are repeats, but the warning waits for enough particles
+    tracker = ParticleTracker(0, 0, 5)
+    half = MIN_PARTICLES_FOR_WARNING // 2
+    points = [(i, 0, 1) for i in range(half)]
+    tracker.track(point_table("first", points))
+    tracker.track(point_table("second", points[:-1]))
+    print_result(test_name, not tracker.is_dirty(5), "warning before enough particles", False, tracker.is_dirty(5))
+    tracker.track(point_table("third", points[:1]))
+    print_result(test_name, tracker.num_particles == MIN_PARTICLES_FOR_WARNING and tracker.is_dirty(5),
+        "warning once enough particles", True, tracker.is_dirty(5))
+
+
 # Print out the number of tests passed and failed for the user
 def print_summary():
     print("Number of tests passed: " + str(NUM_PASS))
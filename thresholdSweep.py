@@ -0,0 +1,141 @@
+# Python 3.6.5 script for comparing threshold values on the same images
+# Specifically filters every image in IMAGE_FOLDER_PATH of determineParticleSizes.py
+# once, then finds and measures the particles at each threshold to be compared, and
+# reports the particle counts and size distributions of each side by side.
+
+# Imports:
+import contextlib
+import csv
+import io
+import pathlib
+import time
+import cv2
+import numpy as np
+import determineParticleSizes
+import frameSource
+
+
+# Global constants - FEEL FREE TO MODIFY
+# Threshold values to compare, as THRESH_PARAM would be set. "otsu" stands for
+# the threshold the Otsu algorithm picks for each image (CUSTOM_THRESH = False).
+SWEEP_THRESHOLDS = list(range(40, 141, 10)) + ["otsu"]
+
+# Edges of the Pixel_Diameter bins (in microns) the size distributions are counted in
+DIAMETER_BINS = [0, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500, 1000, 5000]
+
+# The comparison is written here as CSV, with one row per threshold
+SWEEP_RESULTS = str(pathlib.Path("threshold_sweep.csv"))
+
+
+def main():
+    start = time.perf_counter()
+    diameters, num_images = sweep_folder(determineParticleSizes.IMAGE_FOLDER_PATH)
+    rows = compare_thresholds(diameters, num_images)
+    write_report(rows)
+    print_report(rows)
+    print("Swept " + str(len(SWEEP_THRESHOLDS)) + " thresholds over " + str(num_images) + " images in " +
+          str(round(time.perf_counter() - start, 2)) + " seconds")
+    print("Threshold comparison written to " + SWEEP_RESULTS)
+
+
+# Sweep every frame of folder. Returns the Pixel_Diameter of every particle
+# found at each threshold, as a dictionary of lists of arrays keyed by the
+# entries of SWEEP_THRESHOLDS, along with the number of frames swept.
+def sweep_folder(folder):
+    diameters = {threshold: [] for threshold in SWEEP_THRESHOLDS}
+    frame_list = frameSource.find_frames(folder)
+    for frame, reading in frameSource.prefetch_frames(frame_list, determineParticleSizes.read_frame,
+                                                      determineParticleSizes.PREFETCH_FRAMES,
+                                                      determineParticleSizes.PREFETCH_THREADS):
+        print(frameSource.frame_name(frame[0], frame[1]))
+        for threshold, table in sweep_image(reading.result()).items():
+            diameters[threshold].append(table["Pixel_Diameter"])
+
+    return diameters, len(frame_list)
+
+
+# Filter one image once and find its particles at each of SWEEP_THRESHOLDS, the
+# same way determineParticleSizes.analyse() would with the settings at the top of
+# it, but without any debug images. The filters do not depend on the threshold,
+# apart from the regions denoised with DENOISE_ROI_ONLY, which are found at the
+# highest threshold so they cover the particles of every other one. Returns a
+# dictionary of ParticleTables keyed by the entries of SWEEP_THRESHOLDS.
+def sweep_image(img):
+    dps = determineParticleSizes
+    config = dps.AnalysisConfig(CUSTOM_THRESH = True)
+    tables = {}
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        img = dps.crop_left_border(img)
+        values = threshold_values(dps.increase_contrast(dps.grayscale(img), config))
+
+        filter_config = config.replace(THRESH_PARAM = max(values.values()))
+        sobel_img, laplacian_img, clahe_img = dps.apply_filters("sweep", img, filter_config)
+
+        for threshold, value in values.items():
+            threshold_config = config.replace(THRESH_PARAM = value)
+            thresh_img = dps.threshold_make_binary(clahe_img, threshold_config)
+            contours, labels, stats = dps.find_particles(thresh_img, threshold_config)
+            table = dps.calc_areas(sobel_img, laplacian_img, thresh_img, contours, labels, stats, "sweep",
+                                   threshold_config)
+            dps.calc_geometry(table.data, table.rects[:, 2:4], threshold_config)
+            tables[threshold] = table
+
+    return tables
+
+
+# The threshold value each entry of SWEEP_THRESHOLDS stands for in an image,
+# given the contrast-enhanced image the threshold is applied to
+def threshold_values(clahe_img):
+    values = {}
+    for threshold in SWEEP_THRESHOLDS:
+        if threshold == "otsu":
+            values[threshold] = cv2.threshold(clahe_img, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)[0]
+        else:
+            values[threshold] = threshold
+
+    return values
+
+
+# One row of the comparison for each threshold: the particle count, the spread
+# of the Pixel_Diameter and how many particles fall in each of DIAMETER_BINS
+def compare_thresholds(diameters, num_images):
+    rows = []
+    for threshold in SWEEP_THRESHOLDS:
+        values = np.concatenate(diameters[threshold]) if diameters[threshold] else np.zeros(0)
+        row = {"Threshold": threshold, "Particles": len(values),
+               "Particles_Per_Image": len(values) / num_images if num_images else 0.0}
+        for name, function in [("Mean_Diameter", np.mean), ("D10", lambda v: np.percentile(v, 10)),
+                               ("D50", np.median), ("D90", lambda v: np.percentile(v, 90))]:
+            row[name] = float(function(values)) if len(values) else ""
+
+        counts = np.histogram(values, DIAMETER_BINS)[0]
+        for low, high, count in zip(DIAMETER_BINS[:-1], DIAMETER_BINS[1:], counts):
+            row["Diameter_" + str(low) + "-" + str(high)] = int(count)
+        rows.append(row)
+
+    return rows
+
+
+# Write the comparison to SWEEP_RESULTS
+def write_report(rows):
+    with open(SWEEP_RESULTS, "w", newline = "") as file:
+        writer = csv.DictWriter(file, list(rows[0].keys()))
+        writer.writeheader()
+        writer.writerows(rows)
+
+
+# Print the particle count and diameter spread at each threshold
+def print_report(rows):
+    print("Threshold".ljust(10) + "Particles".rjust(10) + "Per image".rjust(11) + "D10".rjust(9) +
+          "D50".rjust(9) + "D90".rjust(9))
+    for row in rows:
+        print(str(row["Threshold"]).ljust(10) + str(row["Particles"]).rjust(10) +
+              str(round(row["Particles_Per_Image"], 1)).rjust(11) +
+              "".join(str(round(row[name], 1) if row[name] != "" else "-").rjust(9)
+                      for name in ["D10", "D50", "D90"]))
+
+
+# Run the main program
+if __name__ == "__main__":
+    main()